@@ -0,0 +1,187 @@
+import math
+import threading
+import time
+from collections import deque
+from observation import Observation
+
+# Span and bucket width in seconds of each history window.  A window slides one bucket at a time, so it covers
+# between span - width and span seconds.  Every width is a whole number of minutes, so the windows can all be
+# rebuilt from one set of per minute summaries.
+WINDOWS = {'hour': (60 * 60, 60),
+           'day': (24 * 60 * 60, 15 * 60),
+           'week': (7 * 24 * 60 * 60, 60 * 60),
+           'month': (30 * 24 * 60 * 60, 6 * 60 * 60),
+           'year': (365 * 24 * 60 * 60, 24 * 60 * 60)}
+
+# Quantities summarised with count, sum, min and max
+FIELDS = ('temp', 'rain', 'baro', 'humidity', 'wind_speed', 'lumen')
+
+# Wind direction is averaged as a unit vector, so 350 and 10 degrees average to 0 and not 180
+VECTOR = ('wind_x', 'wind_y')
+
+COLUMNS = FIELDS + VECTOR
+
+
+def columns(values):
+    """Returns the COLUMNS of a reading, given as a mapping of Observation fields, in order.  Missing
+    readings are None."""
+    row = [values.get(field) for field in FIELDS]
+    direction = values.get('wind_direction_deg')
+    if direction is None:
+        row += [None, None]
+    else:
+        row += [math.cos(math.radians(direction)), math.sin(math.radians(direction))]
+    return row
+
+
+class Bucket:
+    __slots__ = ('index', 'count', 'total', 'low', 'high')
+
+    def __init__(self, index):
+        self.index = index
+        self.count = [0] * len(COLUMNS)
+        self.total = [0.0] * len(COLUMNS)
+        self.low = [None] * len(COLUMNS)
+        self.high = [None] * len(COLUMNS)
+
+    def merge(self, counts, totals, lows, highs):
+        for (i, count) in enumerate(counts):
+            if count:
+                self.count[i] += count
+                self.total[i] += totals[i]
+                if self.low[i] is None or lows[i] < self.low[i]:
+                    self.low[i] = lows[i]
+                if self.high[i] is None or highs[i] > self.high[i]:
+                    self.high[i] = highs[i]
+
+
+class SlidingWindow:
+    def __init__(self, span, width):
+        """SlidingWindow keeps the count, sum, min and max of every column over the last span seconds
+        in buckets width seconds wide.  The running count and sum cover the whole window and are
+        updated on every merge and expiry, so both cost O(1) per column.  The min and max are too,
+        except after a bucket expires, when they are recomputed once from the remaining buckets.
+        """
+        self._width = width
+        self._size = span // width
+        self._buckets = deque()
+        self._window = Bucket(None)
+        self._extremes_stale = False
+
+    def _expire(self, index):
+        buckets = self._buckets
+        window = self._window
+        while buckets and buckets[0].index <= index - self._size:
+            old = buckets.popleft()
+            for (i, count) in enumerate(old.count):
+                if count:
+                    window.count[i] -= count
+                    window.total[i] = window.total[i] - old.total[i] if window.count[i] else 0.0
+            self._extremes_stale = True
+
+    def _refresh_extremes(self):
+        window = self._window
+        window.low = [None] * len(COLUMNS)
+        window.high = [None] * len(COLUMNS)
+        for bucket in self._buckets:
+            for i in range(len(COLUMNS)):
+                if bucket.count[i]:
+                    if window.low[i] is None or bucket.low[i] < window.low[i]:
+                        window.low[i] = bucket.low[i]
+                    if window.high[i] is None or bucket.high[i] > window.high[i]:
+                        window.high[i] = bucket.high[i]
+        self._extremes_stale = False
+
+    def merge(self, when, counts, totals, lows, highs):
+        """Adds a summary of readings taken at when (epoch seconds).  A single reading is a count of one with
+        the value as its sum, min and max."""
+        index = int(when // self._width)
+        self._expire(max(index, self._buckets[-1].index if self._buckets else index))
+        buckets = self._buckets
+        if not buckets or buckets[-1].index < index:
+            bucket = Bucket(index)
+            buckets.append(bucket)
+        else:
+            # Late readings go to their own bucket if it is still in the window
+            bucket = next((b for b in reversed(buckets) if b.index == index), None)
+            if bucket is None:
+                if index <= buckets[-1].index - self._size:
+                    return
+                bucket = Bucket(index)
+                position = next(i for (i, b) in enumerate(buckets) if b.index > index)
+                buckets.insert(position, bucket)
+        bucket.merge(counts, totals, lows, highs)
+        if not self._extremes_stale:
+            self._window.merge(counts, totals, lows, highs)
+        else:
+            window = self._window
+            for (i, count) in enumerate(counts):
+                if count:
+                    window.count[i] += count
+                    window.total[i] += totals[i]
+
+    def summary(self, now):
+        """Returns the window's Bucket of running totals as of now."""
+        self._expire(int(now // self._width))
+        if self._extremes_stale:
+            self._refresh_extremes()
+        return self._window
+
+
+class RollingAggregates:
+    def __init__(self, windows=WINDOWS):
+        """RollingAggregates summarises readings over each of the history windows as they arrive.
+        windows maps each window name to its (span, bucket width) in seconds.
+        """
+        self._lock = threading.Lock()
+        self._windows = {name: SlidingWindow(span, width) for (name, (span, width)) in windows.items()}
+        self.readings = 0
+
+    def add(self, when, **values):
+        """Adds one reading taken at when (epoch seconds); values are keyed by Observation field."""
+        row = columns(values)
+        counts = [0 if value is None else 1 for value in row]
+        with self._lock:
+            for window in self._windows.values():
+                window.merge(when, counts, row, row, row)
+            self.readings += 1
+
+    def merge(self, when, counts, totals, lows, highs):
+        """Adds a summary of several readings, with one entry per column in each list."""
+        with self._lock:
+            for window in self._windows.values():
+                window.merge(when, counts, totals, lows, highs)
+            self.readings += max(counts)
+
+    def merge_window(self, name, when, counts, totals, lows, highs):
+        """Adds a summary to the named window only, for refilling each window from buckets of its own width."""
+        with self._lock:
+            self._windows[name].merge(when, counts, totals, lows, highs)
+
+    def history(self, now=None, stat='mean'):
+        """Returns an Observation per window holding each quantity's mean, or its peak when stat is 'peak'."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return {name: self._observation(window.summary(now), stat, now)
+                    for (name, window) in self._windows.items()}
+
+    @staticmethod
+    def _observation(summary, stat, now):
+        values = {}
+        for (i, field) in enumerate(FIELDS):
+            if summary.count[i]:
+                values[field] = summary.high[i] if stat == 'peak' else summary.total[i] / summary.count[i]
+        (x, y) = (len(FIELDS), len(FIELDS) + 1)
+        if stat != 'peak' and summary.count[x] and (summary.total[x] or summary.total[y]):
+            values['wind_direction_deg'] = round(math.degrees(math.atan2(summary.total[y], summary.total[x])), 1) % 360
+        return Observation(time=now, **values)
+
+    def stats(self, field, window, now=None):
+        """Returns (min, max, mean, sum, count) of field over the named window."""
+        i = COLUMNS.index(field)
+        now = time.time() if now is None else now
+        with self._lock:
+            summary = self._windows[window].summary(now)
+            count = summary.count[i]
+            return (summary.low[i], summary.high[i], summary.total[i] / count if count else None,
+                    summary.total[i], count)
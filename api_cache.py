@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from requests.exceptions import ConnectionError
+
+DEFAULT_CACHE_DIR = 'cache'
+
+# Seconds a stored response stays fresh, per API endpoint
+ENDPOINT_TTL = {'conditions': 150, 'forecast10day': 6 * 60 * 60}
+
+# Wunderground's free tier
+FREE_PER_MINUTE = 10
+FREE_PER_DAY = 500
+
+
+class BudgetExceededError(ConnectionError):
+    """Raised instead of making a request that would go over the API quota."""
+
+
+class ResponseCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=ENDPOINT_TTL):
+        """ResponseCache stores decoded API responses on disk, one file per query, so a restart
+        within an endpoint's time to live is served without spending a request.  ttl maps each
+        endpoint name to the number of seconds its responses stay fresh.
+        """
+        self._directory = directory
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self._directory, re.sub(r'[^A-Za-z0-9_.-]', '_', key) + '.json')
+
+    def get(self, endpoint, key, same_day=False):
+        """Returns the stored response for key if it is younger than the endpoint's ttl, else None.  With same_day
+        the response must also have been fetched on today's date."""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        fetched = entry.get('fetched', 0)
+        if time.time() - fetched > self._ttl.get(endpoint, 0) or \
+                (same_day and time.strftime('%Y%m%d', time.localtime(fetched)) != time.strftime('%Y%m%d')):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.get('body')
+
+    def put(self, key, body):
+        path = self._path(key)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'fetched': time.time(), 'body': body}, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print("Could not write response cache: {}".format(str(e)))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class RequestBudget:
+    def __init__(self, per_minute=FREE_PER_MINUTE, per_day=FREE_PER_DAY, reserve=10, directory=DEFAULT_CACHE_DIR):
+        """RequestBudget counts the API requests spent in the last minute and the current day and
+        refuses any that would go over per_minute or per_day.  The day's count is kept on disk so a
+        restart does not reset it.  plan_interval spreads the rest of the day's quota, less reserve
+        requests held back for forecasts and retries, evenly over the time left in the day.
+        """
+        self._per_minute = per_minute
+        self._per_day = per_day
+        self._reserve = reserve
+        self._path = os.path.join(directory, 'budget.json')
+        self._lock = threading.Lock()
+        self._minute = deque()
+        self._day = time.strftime('%Y%m%d')
+        self._spent = {}
+        self.refused = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('day') == self._day:
+            self._spent = state.get('spent', {})
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path + '.tmp', 'w') as f:
+                json.dump({'day': self._day, 'spent': self._spent}, f)
+            os.replace(self._path + '.tmp', self._path)
+        except OSError as e:
+            print("Could not write request budget: {}".format(str(e)))
+
+    def _roll(self, now):
+        day = time.strftime('%Y%m%d', time.localtime(now))
+        if day != self._day:
+            self._day = day
+            self._spent = {}
+        while self._minute and now - self._minute[0] >= 60:
+            self._minute.popleft()
+
+    def spent_today(self):
+        return sum(self._spent.values())
+
+    def acquire(self, endpoint):
+        """Records a request to endpoint and returns True, or returns False if it would exceed the quota."""
+        with self._lock:
+            now = time.time()
+            self._roll(now)
+            if len(self._minute) >= self._per_minute or self.spent_today() >= self._per_day:
+                self.refused += 1
+                return False
+            self._minute.append(now)
+            self._spent[endpoint] = self._spent.get(endpoint, 0) + 1
+            self._save()
+            return True
+
+    def plan_interval(self, floor=None):
+        """Returns the number of seconds between requests that uses the rest of today's quota evenly.  The result
+        is never less than floor, nor less than the per minute limit allows."""
+        with self._lock:
+            now = time.time()
+            self._roll(now)
+            local = time.localtime(now)
+            left = 86400 - (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec)
+            calls = self._per_day - self._reserve - self.spent_today()
+        interval = left / calls if calls > 0 else left
+        return max(interval, 60.0 / self._per_minute, floor or 0)
+
+    def stats(self):
+        with self._lock:
+            self._roll(time.time())
+            return {'day': self._day, 'spent': dict(self._spent), 'last_minute': len(self._minute),
+                    'per_minute': self._per_minute, 'per_day': self._per_day, 'refused': self.refused}
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    with _shared_lock:
+        if 'cache' not in _shared:
+            _shared['cache'] = ResponseCache()
+        return _shared['cache']
+
+
+def shared_budget():
+    with _shared_lock:
+        if 'budget' not in _shared:
+            _shared['budget'] = RequestBudget()
+        return _shared['budget']
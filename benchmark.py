@@ -0,0 +1,221 @@
+import argparse
+import json
+import time
+import tracemalloc
+import display
+from system_data import SystemData
+from instrumentation import percentile
+from weather import parse_forecasts, DayForecast
+from observation import Observation
+
+# Canned readings cycled through by the benchmark
+STATION_FIXTURES = [
+    ({'temp': 72.4, 'humidity': 48.0, 'baro': 30.02, 'wind_speed': 7.0, 'wind_direction_deg': 225.0,
+      'wind_gust': 12.0, 'wind_avg': 6.3, 'lumen': 812.0},
+     {'wind_direction': 'SW', 'wind_power': 'calm', 'sig_strength': 3}),
+    ({'temp': 73.1, 'humidity': 46.0, 'baro': 30.01, 'wind_speed': 15.0, 'wind_direction_deg': 270.0,
+      'wind_gust': 22.5, 'wind_avg': 8.9, 'lumen': 790.5, 'heat_index': 75.0},
+     {'wind_direction': 'West', 'wind_power': 'mild', 'sig_strength': 2}),
+]
+
+FORECAST_FIXTURE = [('Monday', '78', '61', '10', 'partlycloudy'), ('Tuesday', '81', '63', '20', 'chancerain'),
+                    ('Wednesday', '74', '59', '70', 'tstorms'), ('Thursday', '69', '55', '30', 'cloudy'),
+                    ('Friday', '72', '57', '0', 'sunny'), ('Saturday', '75', '60', '10', 'mostlysunny'),
+                    ('Sunday', '77', '62', '40', 'chancetstorms')]
+
+
+def forecast_payload(days=10):
+    """Builds a forecast10day response body shaped like Wunderground's, including the text forecast and the
+    per day fields the display never reads, so parsing it costs what a real response does."""
+    text_days = []
+    simple_days = []
+    for period in range(days):
+        (day, high, low, rain, icon) = FORECAST_FIXTURE[period % len(FORECAST_FIXTURE)]
+        for (half, title) in ((0, day), (1, day + ' Night')):
+            text_days.append({'period': period * 2 + half, 'icon': icon, 'title': title, 'pop': rain,
+                              'icon_url': 'http://icons.wxug.com/i/c/k/{}.gif'.format(icon),
+                              'fcttext': 'Partly cloudy. High {}F. Winds light and variable.'.format(high),
+                              'fcttext_metric': 'Partly cloudy. High 24C. Winds light and variable.'})
+        simple_days.append({
+            'date': {'epoch': str(1500000000 + period * 86400), 'day': period + 1, 'month': 7, 'year': 2017,
+                     'yday': 180 + period, 'weekday_short': day[:3], 'weekday': day, 'ampm': 'PM',
+                     'tz_short': 'EDT', 'tz_long': 'America/New_York', 'pretty': '7:00 PM EDT on July 1, 2017'},
+            'period': period + 1, 'high': {'fahrenheit': high, 'celsius': '25'},
+            'low': {'fahrenheit': low, 'celsius': '15'}, 'conditions': 'Partly Cloudy', 'icon': icon,
+            'icon_url': 'http://icons.wxug.com/i/c/k/{}.gif'.format(icon), 'skyicon': '', 'pop': int(rain),
+            'qpf_allday': {'in': 0.0, 'mm': 0}, 'qpf_day': {'in': 0.0, 'mm': 0}, 'qpf_night': {'in': 0.0, 'mm': 0},
+            'snow_allday': {'in': 0.0, 'cm': 0.0}, 'snow_day': {'in': 0.0, 'cm': 0.0},
+            'snow_night': {'in': 0.0, 'cm': 0.0},
+            'maxwind': {'mph': 15, 'kph': 24, 'dir': 'SW', 'degrees': 225},
+            'avewind': {'mph': 8, 'kph': 13, 'dir': 'SW', 'degrees': 225},
+            'avehumidity': 60, 'maxhumidity': 0, 'minhumidity': 0})
+    return json.dumps({'response': {'version': '0.1', 'features': {'forecast10day': 1}},
+                       'forecast': {'txt_forecast': {'date': '7:00 PM EDT', 'forecastday': text_days},
+                                    'simpleforecast': {'forecastday': simple_days}}})
+
+
+def parse_run(rounds=200, forecast_days=5):
+    """Times decoding and parsing a ten day forecast response and measures its memory: the peak allocated while
+    parsing, and what stays allocated once the response is dropped and only the day records are kept."""
+    body = forecast_payload()
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        parse_forecasts(json.loads(body), forecast_days)
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    decoded = json.loads(body)
+    decoded_bytes = tracemalloc.get_traced_memory()[0]
+    forecasts = parse_forecasts(decoded, forecast_days)
+    del decoded
+    (retained_bytes, peak_bytes) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rounds': rounds, 'payload_bytes': len(body), 'parse': summarize(times),
+            'decoded_bytes': decoded_bytes, 'peak_bytes': peak_bytes, 'retained_bytes': retained_bytes,
+            'days': len(forecasts)}
+
+
+def load_station(system_data, fixture):
+    (readings, state) = fixture
+    ws = system_data.ws
+    ws.publish(ws.current.replace(observation=Observation.now(**readings), **state))
+
+
+def load_forecasts(system_data):
+    forecasts = []
+    for (day, high, low, rain, icon) in FORECAST_FIXTURE[:len(system_data.forecasts.forecasts)]:
+        forecast = DayForecast()
+        forecast.update_day(day=day, high_temp=high, low_temp=low, rain=rain, icon=icon)
+        forecasts.append(forecast)
+    system_data.forecasts.apply_forecast_data(forecasts)
+
+
+def load_indoor(system_data, step):
+    system_data.indoor.publish(Observation.now(temp=70.0 + (step % 10) / 10, humidity=40.0 + (step % 7) / 10))
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95), 'p99': percentile(ordered, 99),
+            'max': ordered[-1] if ordered else 0.0}
+
+
+def surfaces_created(stats):
+    """Surfaces the display had to create: every text or icon cache miss, and the background, labels, clock glyphs
+    and date it renders outside the caches."""
+    return stats['text']['misses'] + stats['icons']['misses'] + stats['surfaces_created']
+
+
+def start_driver(size, forecast_days):
+    system_data = SystemData(forecast_days=forecast_days)
+    load_forecasts(system_data)
+    disp = display.DisplayDriver(size=size, forecast_days=forecast_days, headless=True, system_data=system_data)
+    disp.display_start()
+    return (system_data, disp)
+
+
+def load_step(system_data, step, data_period, indoor_period):
+    if step % data_period == 0:
+        load_station(system_data, STATION_FIXTURES[(step // data_period) % len(STATION_FIXTURES)])
+    if step % indoor_period == 0:
+        load_indoor(system_data, step)
+
+
+def run(frames=600, size=display.DEFAULT_SIZE, forecast_days=5, data_period=209, indoor_period=60):
+    """Renders frames headless from the canned fixtures, one simulated second per frame, and returns
+    the frame and panel timings along with the surfaces created per frame.  The station
+    fixture changes every data_period frames and the indoor reading every indoor_period frames,
+    matching the main loop's update rates."""
+    (system_data, disp) = start_driver(size, forecast_days)
+
+    frame_times = []
+    panel_times = {}
+    surfaces = []
+    start_time = time.mktime(time.localtime())
+
+    for step in range(frames):
+        load_step(system_data, step, data_period, indoor_period)
+        now = time.localtime(start_time + step)
+
+        before = disp.render_stats()
+        t0 = time.perf_counter()
+        disp.update_diplay(now)
+        frame_times.append(time.perf_counter() - t0)
+        surfaces.append(surfaces_created(disp.render_stats()) - surfaces_created(before))
+        for (name, seconds) in disp.panel_times.items():
+            panel_times.setdefault(name, []).append(seconds)
+
+    return {'frames': frames,
+            'frame': summarize(frame_times),
+            'panels': {name: summarize(times) for (name, times) in panel_times.items()},
+            'panel_redraws': {name: len(times) for (name, times) in panel_times.items()},
+            'surfaces_per_frame': summarize(surfaces),
+            'render_stats': disp.render_stats()}
+
+
+def allocation_run(frames=600, size=display.DEFAULT_SIZE, forecast_days=5, data_period=209, indoor_period=60):
+    """Renders the same frames as run with tracemalloc on, in a pass of its own so tracing does not slow the timed
+    frames.  tracemalloc only sees live blocks, so the bytes a frame allocates are measured as the peak traced
+    above what was allocated when it started: memory a frame allocates and frees again still shows.  The bytes
+    still held once the frame is done are reported too."""
+    (system_data, disp) = start_driver(size, forecast_days)
+    allocated = []
+    retained = []
+    start_time = time.mktime(time.localtime())
+
+    tracemalloc.start()
+    for step in range(frames):
+        load_step(system_data, step, data_period, indoor_period)
+        now = time.localtime(start_time + step)
+
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        disp.update_diplay(now)
+        (after, peak) = tracemalloc.get_traced_memory()
+        allocated.append(peak - before)
+        retained.append(max(after - before, 0))
+    tracemalloc.stop()
+    return {'allocated_bytes_per_frame': summarize(allocated), 'retained_bytes_per_frame': summarize(retained)}
+
+
+def report(result):
+    ms = 1000.0
+    print('Frames: {}'.format(result['frames']))
+    frame = result['frame']
+    print('Frame ms      p50 {:8.3f}  p95 {:8.3f}  p99 {:8.3f}  max {:8.3f}'.format(
+        frame['p50'] * ms, frame['p95'] * ms, frame['p99'] * ms, frame['max'] * ms))
+    for (name, times) in sorted(result['panels'].items()):
+        print('{:13} p50 {:8.3f}  p95 {:8.3f}  p99 {:8.3f}  redraws {}'.format(
+            name, times['p50'] * ms, times['p95'] * ms, times['p99'] * ms, result['panel_redraws'][name]))
+    for key in ('allocated_bytes_per_frame', 'retained_bytes_per_frame', 'surfaces_per_frame'):
+        values = result[key]
+        print('{:26} p50 {}  p95 {}  p99 {}  max {}'.format(key, values['p50'], values['p95'], values['p99'],
+                                                          values['max']))
+    print('Render stats: {}'.format(result['render_stats']))
+
+
+def report_parse(result):
+    parse = result['parse']
+    print('Forecast parse ({} rounds, {} byte response)'.format(result['rounds'], result['payload_bytes']))
+    print('Parse ms      p50 {:8.3f}  p95 {:8.3f}  p99 {:8.3f}  max {:8.3f}'.format(
+        parse['p50'] * 1000.0, parse['p95'] * 1000.0, parse['p99'] * 1000.0, parse['max'] * 1000.0))
+    print('Decoded response {} bytes, parse peak {} bytes, kept for {} days {} bytes'.format(
+        result['decoded_bytes'], result['peak_bytes'], result['days'], result['retained_bytes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render PyWeather frames headless and report frame timings.')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--size', type=int, nargs=2, default=display.DEFAULT_SIZE, metavar=('X', 'Y'))
+    parser.add_argument('--days', type=int, default=5, choices=(3, 5, 7))
+    parser.add_argument('--parse-rounds', type=int, default=200)
+    args = parser.parse_args()
+    result = run(frames=args.frames, size=tuple(args.size), forecast_days=args.days)
+    result.update(allocation_run(frames=args.frames, size=tuple(args.size), forecast_days=args.days))
+    report(result)
+    report_parse(parse_run(rounds=args.parse_rounds, forecast_days=args.days))
+
+
+if __name__ == '__main__':
+    main()
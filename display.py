@@ -2,11 +2,23 @@ import pygame
 import os
 import time
 from requests.exceptions import ConnectionError
-from system_data import SystemData
+from system_data import SystemData, DEFAULT_LOCATIONS
 from settings import ICON_BASE_DIR, ICON_DICTIONARY, ICON_TYPES, COMPASS_DIR
-import threading
+from display_cache import (FontRegistry, IconCache, TextCache, GlyphAtlas, DEFAULT_ICON_CACHE_BYTES,
+                           DEFAULT_TEXT_CACHE_ENTRIES)
+from layout import Layout, FORECAST_TEXT, DETAIL_TEXT
+from observation import format_value
+from contextlib import nullcontext
+from scheduler import Scheduler
+from fetcher import Fetcher
+from http_client import shared_client
+from api_cache import shared_budget, shared_cache
 
 DEFAULT_DRIVERS = ('fbcon', 'directfb', 'svgalib', 'Quartz')
+HEADLESS_DRIVERS = ('dummy', 'offscreen')
+
+# Posted when new data has been stored so the loop wakes and redraws without waiting for the next second
+DATA_EVENT = pygame.USEREVENT + 1
 DEFAULT_SIZE = (1024, 600)
 DEFAULT_SCREEN = 'resizable'
 
@@ -15,20 +27,28 @@ class DisplayDriver:
 
     def __init__(self, drivers=DEFAULT_DRIVERS, size=DEFAULT_SIZE, screen_type=DEFAULT_SCREEN, borders=(5, 5),
                  border_width=3, line_color=(255, 255, 255), font='freesans', font_color=(255, 255, 255),
-                 icons=ICON_DICTIONARY):
+                 icons=ICON_DICTIONARY, icon_cache_bytes=DEFAULT_ICON_CACHE_BYTES,
+                 text_cache_entries=DEFAULT_TEXT_CACHE_ENTRIES, forecast_days=5, headless=False, system_data=None,
+                 instrumentation=None, locations=DEFAULT_LOCATIONS):
         """DisplayDriver class is the class that build the base display for use in the weather
         app.  Argument descriptions: drivers is a tuple of strings with available SDL_VIDEODRIVER
         environmental varaibles; size is a tuple of two integers describing the x, y size of the
         screen; screen_type is a string value that corresponds to the pygame constants for
-        dispay.set_mode
+        dispay.set_mode; icon_cache_bytes caps the memory held by pre-scaled icon surfaces;
+        text_cache_entries caps the number of rendered text surfaces kept between frames;
+        forecast_days is the number of days shown in the forecast strip (3, 5 or 7); headless renders to
+        an off-screen SDL driver instead of a display; system_data replaces the default SystemData;
+        instrumentation is an optional Instrumentation that times panels, data updates and sensor reads;
+        locations is a list of (state, city) pairs the display can switch between
         """
 
         formats = {'no_frame': pygame.NOFRAME, 'full_screen': pygame.FULLSCREEN, 'double_buff': pygame.DOUBLEBUF,
                    'hw_surface': pygame.HWSURFACE, 'open_GL': pygame.OPENGL, 'resizable': pygame.RESIZABLE}
 
-        self._system_data = SystemData()
+        self._system_data = system_data or SystemData(forecast_days=forecast_days, locations=locations)
         self._display_instance = None
-        self._drivers = drivers
+        self._drivers = HEADLESS_DRIVERS if headless else drivers
+        self._headless = headless
         self._size = size
         self._borders = borders
         self._border_width = border_width
@@ -39,14 +59,40 @@ class DisplayDriver:
         self._icons = icons
         self._base_dir = os.getcwd() + ICON_BASE_DIR
         self._scale_icons = True
-        self._xmax = self._size[0] - self._borders[0]
-        self._ymax = self._size[1] - self._borders[1]
+        self._forecast_days = forecast_days
         self._av = 1
         self._av_time = 1
         self._screen = None
+        self._layout = None
+        self._fonts = FontRegistry(self._font, self._size[1] - self._borders[1])
+        self._icon_cache = IconCache(icon_cache_bytes)
+        self._text = TextCache(text_cache_entries)
         self._blits = []
+        self._background = None
+        self._time_glyphs = None
+        self._seconds_glyphs = None
+        self._date_label = (None, None)
+        # Surfaces made outside the caches: the background, its labels, the clock glyphs and the date
+        self._surfaces_created = 0
+        self._now = time.localtime()
+        self._panel_state = {}
+        self._panel_versions = {}
+        self._station = None
+        self._indoor = None
+        self._days = ()
+        self._full_redraw = True
+        self.panel_times = {}
+        self._instrumentation = instrumentation
+        self._scheduler = Scheduler()
+        self._fetcher = Fetcher(workers=len(self._system_data.locations) + 1, on_done=self.__fetch_done)
+        self._run_delay = None
         self.running = True
 
+    def __timer(self, phase):
+        if self._instrumentation:
+            return self._instrumentation.timer(phase)
+        return nullcontext()
+
     def __append_blits(self, blits):
 
         for blit in blits:
@@ -55,7 +101,10 @@ class DisplayDriver:
     def __get_driver(self):
         has_driver = False
         for driver in self._drivers:
-            if not os.getenv('SDL_VIDEODRIVER'):
+            if self._headless:
+                # The headless drivers have to win over anything set in the environment
+                os.environ['SDL_VIDEODRIVER'] = driver
+            elif not os.getenv('SDL_VIDEODRIVER'):
                 os.putenv('SDL_VIDEODRIVER', driver)
             try:
                 pygame.display.init()
@@ -69,6 +118,14 @@ class DisplayDriver:
         if not has_driver:
             raise AssertionError('No video driver available for use!')
 
+    def __resize(self, size):
+        """Rebuilds the screen at the new window size and drops anything that was sized to the old one."""
+        self._size = size
+        self._screen = pygame.display.set_mode(self._size, self._format)
+        if self._layout.resize(self._size):
+            self._text.clear()
+        self._full_redraw = True
+
     def __render_screen(self):
         for _ in range(len(self._blits)):
             blit = self._blits.pop() # pop off each item once drawn to allow for updates to display
@@ -85,135 +142,184 @@ class DisplayDriver:
 
         self._screen.fill((0, 0, 0))
         pygame.font.init()
+        self._layout = Layout(self._size, self._borders, self._fonts, self._forecast_days)
 
         # Mouse hider -- Comment the next line to see mouse over the display
         pygame.mouse.set_visible(0)
         pygame.display.update()
 
     def __draw_frames(self):
-        """This function should be called by the display_start function only. It renders the frames for the display"""
-        xmin = self._borders[0]
-        ymin = self._borders[1]
-        xmax = self._xmax
-        ymax = self._ymax
-        line_width = self._border_width
-
-        # Horizontal line settings
-        hz = (0.1, 0.5, 0.58)
-
-        # Vertical line settings
-        vt = (0.33, 0.66, 0.2, 0.4, 0.6, 0.8)
-
-        self._screen.fill((0, 0, 0))
-
-        # Draw Screen Border
-        pygame.draw.line(self._screen, self._line_color, (xmin, xmin), (xmax, xmin), line_width)  # Top
-        pygame.draw.line(self._screen, self._line_color, (xmin, xmin), (xmin, ymax), line_width)  # Left
-        pygame.draw.line(self._screen, self._line_color, (xmin, ymax), (xmax, ymax), line_width)  # Bottom
-        pygame.draw.line(self._screen, self._line_color, (xmax, ymin), (xmax, ymax), line_width)  # Right Edge
-
-        # Draw Inner Frames
-        # Horizontal lines (1, 2, 3)
-        for h in hz:
-            pygame.draw.line(self._screen, self._line_color, (xmin, ymax * h), (xmax, ymax * h), line_width)
-
-        # Vertical lines (1, 2)
-        for j in range(2):
-            v = vt[j]
-            pygame.draw.line(self._screen, self._line_color, (xmax * v, ymax * hz[2]),
-                             (xmax * v, ymax * hz[0]), line_width)
+        """This function is called by update_diplay on a full redraw. It rebuilds the background layer and copies
+        it to the screen"""
+        self.__draw_background()
+        self._screen.blit(self._background, (0, 0))
+
+    def __render_label(self, font, text, color=None):
+        """Renders text that is drawn once per full redraw rather than through the text cache, and counts the
+        surface."""
+        self._surfaces_created += 1
+        return font.render(text, True, color or self._line_color)
+
+    def __draw_grid(self, surface):
+        """Draws the border and inner frame lines onto surface."""
+        for (start, end) in self._layout.lines:
+            pygame.draw.line(surface, self._line_color, start, end, self._border_width)
+
+    def __take_snapshots(self):
+        """Takes this frame's snapshot of each producer's data, so every panel draws from the same published
+        state even if a producer publishes mid frame.  Returns the version key of each source."""
+        location = self._system_data.location
+        (station_version, self._station) = self._system_data.ws.snapshot()
+        (indoor_version, self._indoor) = self._system_data.indoor.snapshot()
+        (forecast_version, self._days) = self._system_data.forecasts.snapshot()
+        return {'station': (location, station_version), 'indoor': indoor_version,
+                'forecasts': (location, forecast_version)}
+
+    def __panels(self):
+        """Returns each panel's name, draw functions, the source its data is published by (None for the clock)
+        and the values it renders.  A panel is redrawn only when its source published a new version since it was
+        last drawn and the values it renders differ from the ones it was last drawn with."""
+        station = self._station
+        obs = station.observation
+        days = tuple((f.day, f.high_temp, f.low_temp, f.rain, f.icon) for f in self._days)
+
+        return (('header', (self.__display_datetime, self.__display_connected), None,
+                 (self._now[:6], station.sig_strength)),
+                ('left', (self.__display_left_frame,), 'station', (obs.temp, obs.humidity)),
+                ('vane', (self.__weather_vane,), 'station',
+                 (obs.wind_speed, station.wind_direction, station.wind_power)),
+                ('detail', (self.__display_sensor_detail_data,), 'station', (obs, station.history['hour'])),
+                ('indoor', (self.__display_indoor,), 'indoor', (self._indoor.temp, self._indoor.humidity)),
+                ('wind_avg', (self.__display_wind_avg,), 'station', (obs.wind_gust, obs.wind_avg)),
+                ('feels_like', (self.__display_feels_like,), 'station', (obs.heat_index, obs.wind_chill)),
+                ('forecasts', (self.__display_forecasts,), 'forecasts', days))
+
+    def __draw_panels(self):
+        """Redraws the panels whose inputs changed and returns the list of rects that need to be flipped.  The time
+        spent drawing each redrawn panel is left in panel_times."""
+        dirty = []
+        self.panel_times = {}
+        versions = self.__take_snapshots()
+        for (name, draws, source, inputs) in self.__panels():
+            version = versions.get(source)
+            if not self._full_redraw:
+                if source is not None and self._panel_versions.get(name) == version:
+                    continue
+                self._panel_versions[name] = version
+                if self._panel_state.get(name) == inputs:
+                    continue
+            start = time.perf_counter()
+            rect = self._layout.rects[name]
+            self._screen.set_clip(rect)
+            if not self._full_redraw:
+                self._screen.blit(self._background, rect, rect)
+            with self.__timer('panel.' + name):
+                for draw in draws:
+                    draw()
+                # Blits the panel deferred to the blit list, which are part of its cost
+                self.__render_screen()
+            self._screen.set_clip(None)
+            self._panel_state[name] = inputs
+            self._panel_versions[name] = version
+            self.panel_times[name] = time.perf_counter() - start
+            dirty.append(rect)
+        return dirty
+
+    def __draw_background(self):
+        """Renders the frame lines and every label that never changes into an off-screen surface.  It is rebuilt
+        only when the resolution changes; panels restore their region from it before drawing their values."""
+        self._background = pygame.Surface(self._size).convert()
+        self._surfaces_created += 1
+        self._background.fill((0, 0, 0))
+        self.__draw_grid(self._background)
+        self.__connected_labels(self._background)
+        self.__weather_vane_labels(self._background)
+        self.__indoor_labels(self._background)
+        self.__feels_like_labels(self._background)
+        self.__left_frame_labels(self._background)
+        self.__wind_avg_labels(self._background)
+        self.__sensor_detail_labels(self._background)
+
+    def __build_clock_glyphs(self):
+        """Pre-renders the digits and colon at the time and seconds font sizes.  Called on every full redraw so the
+        glyphs follow the current resolution."""
+        th = 0.07     # Time Text Height
+        sh = 0.03     # Seconds Text Height
 
-        # Vertical lines (3 - 6)
-        for j in range(2, len(vt)):
-            v = vt[j]
-            pygame.draw.line(self._screen, self._line_color, (xmax * v, ymax), (xmax * v, ymax * hz[2]), line_width)
+        self._time_glyphs = GlyphAtlas(self._fonts.get(th), self._font_color)
+        self._seconds_glyphs = GlyphAtlas(self._fonts.get(sh), self._font_color, chars='0123456789')
+        self._surfaces_created += len(self._time_glyphs) + len(self._seconds_glyphs)
+        self._date_label = (None, None)
 
     def __display_datetime(self):
 
-        th = 0.07     # Time Text Height
-        sh = 0.03     # Seconds Text Height
         dh = 0.06     # Date Text Height
-        dt_y = 13     # Date Y Position
-        tm_y = 10     # Time Y Position
-        tm_y_sm = 15  # Time Y Position Small
-
-        tfont = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)  # Time Font
-        dfont = pygame.font.SysFont(self._font, int(self._ymax * dh), bold=1)  # Date Font
-        sfont = pygame.font.SysFont(self._font, int(self._ymax * sh), bold=1)  # Small Font for Seconds
-
-        tm1 = time.strftime("%H:%M", time.localtime())  # Time String
-        tm2 = time.strftime("%S", time.localtime())     # Seconds String
-        dt1 = time.strftime("%d %b %y").upper()         # Date String
+        points = self._layout.points
+        (tc, tm_y) = points['clock']
+        tm_y_sm = points['clock_seconds_y']
+        (dr, dt_y) = points['date']
+
+        now = self._now
+        tm1 = time.strftime("%H:%M", now)  # Time String
+        tm2 = time.strftime("%S", now)     # Seconds String
+
+        # The date only changes at midnight, so its surface is kept until the day rolls over
+        (day, rdt1) = self._date_label
+        if day != (now.tm_year, now.tm_yday):
+            dt1 = time.strftime("%d %b %y", now).upper()  # Date String
+            rdt1 = self.__render_label(self._fonts.get(dh), dt1, self._font_color)
+            self._date_label = ((now.tm_year, now.tm_yday), rdt1)
 
         # Build the Date / Time
-        rtm1 = tfont.render(tm1, True, self._font_color)
-        (tx1, ty1) = rtm1.get_size()
-        rtm2 = sfont.render(tm2, True, self._font_color)
-        (tx2, ty2) = rtm2.get_size()
-        rdt1 = dfont.render(dt1, True, self._font_color)
+        (tx1, ty1) = self._time_glyphs.size(tm1)
+        (tx2, ty2) = self._seconds_glyphs.size(tm2)
         (dx1, dy1) = rdt1.get_size()
 
-        tp = self._xmax / 2 - (tx1 + tx2) / 2
-        dp = self._xmax - (dx1 + (self._borders[1] * 2))
-        self._screen.blit(rtm1, (tp, tm_y))
-        self._screen.blit(rtm2, (tp + tx1 + 3, tm_y_sm))
-        self._screen.blit(rdt1, (dp, dt_y))
+        tp = tc - (tx1 + tx2) / 2
+        self._time_glyphs.blit(self._screen, tm1, (tp, tm_y))
+        self._seconds_glyphs.blit(self._screen, tm2, (tp + tx1 + 3, tm_y_sm))
+        self._screen.blit(rdt1, (dr - dx1, dt_y))
 
     def __get_signal_icon(self):
-        sig_no = self._system_data.ws.sig_strength
+        sig_no = self._station.sig_strength
         return self._base_dir + self._icons['sig{}'.format(sig_no)]
 
-    def __display_connected(self):
-        xmin = self._borders[0]
-        ymin = self._borders[1]
-        station_scale = 0.35
-        signal_scale = 0.25
+    def __station_icon(self):
+        station_scale = 0.35 if self._scale_icons else None
+        return self._icon_cache.get(self._base_dir + self._icons['weather_station'], scale=station_scale)
 
-        station_icon = pygame.image.load_extended(self._base_dir + self._icons['weather_station']).convert_alpha()
+    def __connected_labels(self, surface):
+        surface.blit(self.__station_icon(), self._layout.points['station'])
 
-        signal_icon = pygame.image.load_extended(self.__get_signal_icon()).convert_alpha()
-        (stix, stiy) = station_icon.get_size()
-        (sgix, sgiy) = signal_icon.get_size()
+    def __display_connected(self):
+        ymin = self._borders[1]
+        signal_scale = 0.25 if self._scale_icons else None
 
-        if self._scale_icons:
-            station_icon = pygame.transform.scale(station_icon, (int(stix * station_scale), int(stiy * station_scale)))
-            (stix, stiy) = station_icon.get_size()
-            signal_icon = pygame.transform.scale(signal_icon, (int(sgix * signal_scale), int(sgiy * signal_scale)))
+        signal_icon = self._icon_cache.get(self.__get_signal_icon(), scale=signal_scale)
+        (stix, stiy) = self.__station_icon().get_size()
 
-        self._screen.blit(station_icon, (xmin * 2, ymin))
         self._screen.blit(signal_icon, (stix + 14, ymin + 9))
 
     def __display_forecasts(self):
-        # TODO: Maybe I'll add some form of (3, 5, 7) day forecast option
-        days = 5
+        points = self._layout.points
+        yo = points['forecast.top']
+        yb = points['forecast.bottom']
 
-        # TODO: make this part of self
-        hz = (0.1, 0.5, 0.58)
-        vt = (0.33, 0.66, 0.2, 0.4, 0.6, 0.8)
-
-        vdiff = vt[4] - vt[3]
-        yo = self._ymax * hz[2] + 5
-        vc = 0 + vdiff / 2  # Y center
-
-        th = 0.045          # Text Height
-        rpth = 0.08         # Rain Present Text Height
         gp = 5              # Line Spacing Gap
 
-        font = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * rpth), bold=1)
+        font = self._fonts.get(FORECAST_TEXT['day'])
+        lgfont = self._fonts.get(FORECAST_TEXT['rain'])
 
-        for j in range(days):
-            vci = vc + (j * vdiff)
-            today = self._system_data.forecasts.forecasts[j]
-            header = font.render(today.day, True, self._line_color)
-            temps = font.render(today.high_temp + ' / ' + today.low_temp, True, self._line_color)
-            rain = lgfont.render(today.rain + '%', True, self._line_color)
+        for (today, vci) in zip(self._days, self._layout.forecast_columns):
+            header = self._text.render(font, today.day, self._line_color)
+            temps = self._text.render(font, today.high_temp + ' / ' + today.low_temp, self._line_color)
+            rain = self._text.render(lgfont, today.rain + '%', self._line_color)
 
             icon_path = self._base_dir + 'forecast/unknown.png'
             if today.icon in self._system_data.weather_icons:
                 icon_path = self._base_dir + self._system_data.weather_icons[today.icon]
 
-            icon = pygame.image.load_extended(icon_path)
+            icon = self._icon_cache.get(icon_path)
 
             (hx, hy) = header.get_size()
             (tx, ty) = temps.get_size()
@@ -222,7 +328,7 @@ class DisplayDriver:
 
             """
             if self._scale_icons:
-                icon = pygame.transform.scale(icon, (int(ix * 1.15), int(iy * 1.15)))
+                icon = self._icon_cache.get(icon_path, scale=1.15)
                 (ix, iy) = icon.get_size()
             """
             if iy < 104:
@@ -230,299 +336,272 @@ class DisplayDriver:
             else:
                 ye = 0
 
-            self._screen.blit(header, (self._xmax * vci - hx / 2, yo))
-            self._screen.blit(icon, (self._xmax * vci - ix / 2, hy + yo + ye + (gp * 2)))
-            self._screen.blit(temps, (self._xmax * vci - tx / 2, self._ymax - (ry + ty + (gp * 2))))
-            self._screen.blit(rain, (self._xmax * vci - rx / 2, self._ymax - (ry + gp)))
+            self._screen.blit(header, (vci - hx / 2, yo))
+            self._screen.blit(icon, (vci - ix / 2, hy + yo + ye + (gp * 2)))
+            self._screen.blit(temps, (vci - tx / 2, yb - (ry + ty + (gp * 2))))
+            self._screen.blit(rain, (vci - rx / 2, yb - (ry + gp)))
+
+    def __weather_vane_labels(self, surface):
+        (vc, yc) = self._layout.points['vane']
+        th = 0.1
+        smth = 0.04
+
+        sy = self._fonts.get(th).get_height()
+        mph = self.__render_label(self._fonts.get(smth), 'mph')
+        (mx, my) = mph.get_size()
+
+        surface.blit(mph, (vc - mx / 2, yc + (sy / 2) - (my / 2)))
 
     def __weather_vane(self):
 
-        yc = ((self._ymax * .5 - self._ymax * .1) / 2) + (self._ymax * .1)
-        vc = 0.5 * self._xmax
+        (vc, yc) = self._layout.points['vane']
         th = 0.1
-        smth = 0.04
 
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-        font = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
+        lgfont = self._fonts.get(th)
 
-        mph = font.render('mph', True, self._line_color)
-        speed = lgfont.render(self._system_data.ws.wind_speed['current'], True, self._line_color)
+        speed = self._text.render(lgfont, self._station.observation.text('wind_speed'), self._line_color)
         try:
-            wd = self._system_data.wind_dirs[self._system_data.ws.wind_direction]
-            wf = self._system_data.ws.wind_power
+            wd = self._system_data.wind_dirs[self._station.wind_direction]
+            wf = self._station.wind_power
         except KeyError:
             wd = 'unknown'
             wf = '1'
 
-        icon = pygame.image.load_extended(self._base_dir +
-                                          'compass/{}_{}.png'.format(wd, wf)).convert_alpha()
+        icon = self._icon_cache.get(self._base_dir + 'compass/{}_{}.png'.format(wd, wf))
 
         (ix, iy) = icon.get_size()
         (sx, sy) = speed.get_size()
-        (mx, my) = mph.get_size()
 
         self._screen.blit(speed, (vc - sx / 2, yc - sy / 2))
         self._screen.blit(icon, (vc - ix / 2, yc - iy / 2))
-        self._screen.blit(mph, (vc - mx / 2, yc + (sy / 2) - (my / 2)))
+
+    def __indoor_labels(self, surface):
+        points = self._layout.points
+        smth = 0.03
+
+        name = self.__render_label(self._fonts.get(smth), 'Indoor')
+        (nx, ny) = name.get_size()
+
+        surface.blit(name, (points['indoor.name_x'] - nx / 2, points['middle.top']))
 
     def __display_indoor(self):
-        offset = self._ymax * .03
-        yb = self._ymax * 0.58
-        yt = self._ymax * 0.5
-        xc = (self._xmax * 0.33) / 2
-        xl = self._borders[0]
-        xr = self._xmax * 0.33
+        points = self._layout.points
+        yb = points['middle.bottom']
         th = 0.045
-        smth = 0.03
 
-        font = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
+        lgfont = self._fonts.get(th)
 
-        name = font.render('Indoor', True, self._line_color)
-        temp = lgfont.render('{} f'.format(self._system_data.indoor.temp_f + chr(0x00B0)), True, self._line_color)
-        humid = lgfont.render('{}% RH'.format(self._system_data.indoor.humidity), True, self._line_color)
+        indoor = self._indoor
+        temp = self._text.render(lgfont, indoor.text('temp', chr(0x00B0) + ' f'), self._line_color)
+        humid = self._text.render(lgfont, format_value(indoor.humidity, 1, '% RH'), self._line_color)
 
-        (nx, ny) = name.get_size()
         (tx, ty) = temp.get_size()
         (hx, hy) = humid.get_size()
 
-        self._screen.blit(name, (xc - nx / 2, yt))
-        self._screen.blit(temp, (xl + offset, yb - ty))
-        self._screen.blit(humid, (xr - hx - offset, yb - hy))
+        self._screen.blit(temp, (points['indoor.temp_x'], yb - ty))
+        self._screen.blit(humid, (points['indoor.humidity_x'] - hx, yb - hy))
 
-    def __display_feels_like(self):
-        data = self._system_data.ws
-        centering = self._xmax * .085
-        yb = self._ymax * 0.58
-        yt = self._ymax * 0.5
-        xl = self._xmax * 0.66
-        xr = self._xmax
-        lc = xl + centering
-        rc = xr - centering
-        th = 0.045
+    def __feels_like_labels(self, surface):
+        points = self._layout.points
+        yt = points['middle.top']
+        lc = points['feels_like.heat_index_x']
+        rc = points['feels_like.wind_chill_x']
         smth = 0.03
 
-        font = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-
-        def add_symbol(val):
-            if val != 'NA':
-                val += chr(0x00B0) + " f"
-                return val
-            return val
+        font = self._fonts.get(smth)
 
-        heat_idx_label = font.render('Heat Index', True, self._line_color)
-        heat_idx = lgfont.render('{}'.format(add_symbol(data.heat_index)), True, self._line_color)
-        wind_chill_label = font.render('Wind Chill', True, self._line_color)
-        wind_chill = lgfont.render('{}'.format(add_symbol(data.wind_chill)), True, self._line_color)
+        heat_idx_label = self.__render_label(font, 'Heat Index')
+        wind_chill_label = self.__render_label(font, 'Wind Chill')
 
         (hlx, hly) = heat_idx_label.get_size()
-        (hix, hiy) = heat_idx.get_size()
         (wclx, wcly) = wind_chill_label.get_size()
+
+        surface.blit(heat_idx_label, (lc - hlx / 2, yt))
+        surface.blit(wind_chill_label, (rc - wclx / 2, yt))
+
+    def __display_feels_like(self):
+        data = self._station.observation
+        points = self._layout.points
+        yb = points['middle.bottom']
+        lc = points['feels_like.heat_index_x']
+        rc = points['feels_like.wind_chill_x']
+        th = 0.045
+
+        lgfont = self._fonts.get(th)
+
+        heat_idx = self._text.render(lgfont, data.text('heat_index', chr(0x00B0) + ' f', 'NA'), self._line_color)
+        wind_chill = self._text.render(lgfont, data.text('wind_chill', chr(0x00B0) + ' f', 'NA'), self._line_color)
+
+        (hix, hiy) = heat_idx.get_size()
         (wcx, wcy) = wind_chill.get_size()
 
-        self._screen.blit(heat_idx_label, (lc - hlx / 2, yt))
         self._screen.blit(heat_idx, (lc - hix / 2, yb - hiy))
-        self._screen.blit(wind_chill_label, (rc - wclx / 2, yt))
         self._screen.blit(wind_chill, (rc - wcx / 2, yb - wcy))
 
-    def __display_left_frame(self):
-        # TODO: Clean up variables
-        data = self._system_data.ws
-
-        centering = self._xmax * .085
-
-        # yb = self._ymax * 0.5
-        yt = self._ymax * 0.1
-        offset = self._ymax * .04
-        text_border = self._ymax * .008
-        xc = (self._xmax * 0.33) / 2
-        yc = ((self._ymax * .5 - self._ymax * .1) / 2) + (self._ymax * .1)
-        xl = self._borders[0]
-        xr = self._xmax * 0.33
-        lc = xl + centering
-        rc = xr - centering
+    def __left_frame_labels(self, surface):
+        (lc, yc) = self._layout.points['left.temp']
+        (rc, yc) = self._layout.points['left.humidity']
+        text_border = self._layout.ymax * .008
         smth = 0.034
         lth = 0.085
-        th = 0.055
 
-        font = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-        smfont = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * lth), bold=1)
+        smfont = self._fonts.get(smth)
+        # Values are drawn per frame in lgfont; only their height is needed to place the labels around them
+        ty = vy = self._fonts.get(lth).get_height()
 
-        # TODO: Remove the random generator and fill with sensor data
-        temp_label = smfont.render('Temp({})'.format('f'), True, self._line_color)
-        temp = lgfont.render(data.temp['current'], True, self._line_color)
-        var = lgfont.render(data.humidity['current'], True, self._line_color)
-        var_label = smfont.render('Humidity(RH)', True, self._line_color)
-        up = pygame.image.load_extended(self._base_dir + 'navigation/up_arrow.png')
-        down = pygame.image.load_extended(self._base_dir + 'navigation/down_arrow.png')
+        temp_label = self.__render_label(smfont, 'Temp({})'.format('f'))
+        var_label = self.__render_label(smfont, 'Humidity(RH)')
+        up = self._icon_cache.get(self._base_dir + 'navigation/up_arrow.png')
+        down = self._icon_cache.get(self._base_dir + 'navigation/down_arrow.png')
 
-        (tx, ty) = temp.get_size()
         (tlx, tly) = temp_label.get_size()
-        (vx, vy) = var.get_size()
         (vlx, vly) = var_label.get_size()
         (ux, uy) = up.get_size()
         (dx, dy) = down.get_size()
 
+        surface.blit(temp_label, (lc - tlx / 2, yc - (ty / 2) - (tly / 2) - text_border))
+        surface.blit(var_label, (rc - vlx / 2, yc - (vy / 2) - (vly / 2) - text_border))
+        surface.blit(up, (rc - ux / 2, yc - (vy / 2) - vly - uy + text_border))
+        surface.blit(down, (rc - dx / 2, yc + (vy / 2) + text_border))
+
+    def __display_left_frame(self):
+        data = self._station.observation
+        (lc, yc) = self._layout.points['left.temp']
+        (rc, yc) = self._layout.points['left.humidity']
+        lth = 0.085
+
+        lgfont = self._fonts.get(lth)
+
+        temp = self._text.render(lgfont, data.text('temp'), self._line_color)
+        var = self._text.render(lgfont, data.text('humidity', '%'), self._line_color)
+
+        (tx, ty) = temp.get_size()
+        (vx, vy) = var.get_size()
+
         # add render items to the blit list
-        blits = [(temp_label, (lc - tlx / 2, yc - (ty / 2) - (tly / 2) - text_border)),
-                 (temp, (lc - tx / 2, yc - ty / 2)),
-                 (var_label, (rc - vlx / 2, yc - (vy / 2) - (vly / 2) - text_border)),
-                 (var, (rc - vx / 2, yc - vy / 2)),
-                 (up, (rc - ux / 2, yc - (vy / 2) - vly - uy + text_border)),
-                 (down, (rc - dx / 2, yc + (vy / 2) + text_border))
+        blits = [(temp, (lc - tx / 2, yc - ty / 2)),
+                 (var, (rc - vx / 2, yc - vy / 2))
                  ]
 
         self.__append_blits(blits)
 
+    def __wind_avg_labels(self, surface):
+        points = self._layout.points
+        yt = points['middle.top']
+        lc = points['wind_avg.gust_x']
+        rc = points['wind_avg.avg_x']
+        th = 0.03
+
+        font = self._fonts.get(th)
+
+        wind_peak_label = self.__render_label(font, 'Wind Gust')
+        wind_avg_label = self.__render_label(font, 'Avg. Wind')
+
+        (wplx, wply) = wind_peak_label.get_size()
+        (walx, waly) = wind_avg_label.get_size()
+
+        surface.blit(wind_peak_label, (lc - wplx / 2, yt))
+        surface.blit(wind_avg_label, (rc - walx / 2, yt))
+
     def __display_wind_avg(self):
-        centering = self._xmax * .085
-        offset = self._ymax * .008
-        yb = self._ymax * 0.58
-        yt = self._ymax * 0.5
-        xl = self._xmax * 0.33
-        xr = self._xmax * 0.66
-        lc = xl + centering
-        rc = xr - centering
+        points = self._layout.points
+        offset = self._layout.ymax * .008
+        yb = points['middle.bottom']
+        lc = points['wind_avg.gust_x']
+        rc = points['wind_avg.avg_x']
         lth = 0.045
-        th = 0.03
         smth = .025
 
-        smfont = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
-        font = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * lth), bold=1)
+        smfont = self._fonts.get(smth)
+        lgfont = self._fonts.get(lth)
 
-        wind_peak_label = font.render('Wind Gust', True, self._line_color)
-        peak_wind = lgfont.render(self._system_data.ws.wind_gust, True, self._line_color)
-        wind_avg_label = font.render('Avg. Wind', True, self._line_color)
-        wind_avg = lgfont.render(self._system_data.ws.wind_avg, True, self._line_color)
-        mph = smfont.render('mph', True, self._line_color)
+        obs = self._station.observation
+        peak_wind = self._text.render(lgfont, obs.text('wind_gust'), self._line_color)
+        wind_avg = self._text.render(lgfont, obs.text('wind_avg'), self._line_color)
+        mph = self._text.render(smfont, 'mph', self._line_color)
 
-        (wplx, wply) = wind_peak_label.get_size()
         (wpx, wpy) = peak_wind.get_size()
-        (walx, waly) = wind_avg_label.get_size()
         (wax, way) = wind_avg.get_size()
-        (mx, my) = mph.get_size()
 
-        self._screen.blit(wind_peak_label, (lc - wplx / 2, yt))
         self._screen.blit(peak_wind, (lc - wpx / 2, yb - wpy))
-        self._screen.blit(wind_avg_label, (rc - walx / 2, yt))
         self._screen.blit(wind_avg, (rc - wax / 2, yb - way))
         self._screen.blit(mph, (lc + (wpx / 2) + offset, yb - wpy))
         self._screen.blit(mph, (rc + (wax / 2) + offset, yb - way))
 
-    def __display_sensor_detail_data(self):
-
-        data = self._system_data.ws
-        c = 'current'
-        h = ['hour', 'day', 'week', 'month', 'year']
-        rv = h[0]
-
-        offset = self._ymax * .022
-        bo = offset * 2
-        text_border = self._ymax * .004
-        centerline = self._xmax * .088
-        r_offset = self._xmax * .055
-
-        # Size and position variables
-        yb = self._ymax * 0.5
-        yt = self._ymax * 0.1
-        xc = (self._xmax * 0.33) / 2 + (self._xmax * 0.66)
-        xl = self._xmax * 0.66
-        xr = self._xmax
-        lc = xl + centerline * 2
-        rc = xr - r_offset
-        smth = 0.024
-        lth = 0.035
-        th = 0.031
+    def __sensor_detail_labels(self, surface):
+        points = self._layout.points
+        yh = points['detail.header_y']
+        xl = points['detail.label_x']
+        lc = points['detail.current_x']
+        rc = points['detail.history_x']
 
         # Todo: Make this part of self or store it in settings
         hist_view = ['Peak', 'Average']
         hist_view_time = ['Hour', 'Day', 'Week', 'Month', 'Year']
         cf = ['c', 'f']
 
-        font = pygame.font.SysFont(self._font, int(self._ymax * th), bold=1)
-        smfont = pygame.font.SysFont(self._font, int(self._ymax * smth), bold=1)
-        lgfont = pygame.font.SysFont(self._font, int(self._ymax * lth), bold=1)
+        font = self._fonts.get(DETAIL_TEXT['row'])
+        smfont = self._fonts.get(DETAIL_TEXT['sub_header'])
+        lgfont = self._fonts.get(DETAIL_TEXT['header'])
 
         # Render labels
-        curr = lgfont.render('Current', True, self._line_color)
-        hist = lgfont.render(hist_view[1], True, self._line_color)
-        hist_time = smfont.render(hist_view_time[0], True, self._line_color)
-        trend = smfont.render('Trend', True, self._line_color)
-        temp_label = font.render('Temp ({}):'.format(cf[1]), True, self._line_color)
-        c_temp = font.render(data.temp[c] + chr(0x00B0), True, self._line_color)
-        h_temp = font.render(data.temp[rv] + chr(0x00B0), True, self._line_color)
-        humid_label = font.render('Humidity (RH):', True, self._line_color)
-        c_humid = font.render(data.humidity[c], True, self._line_color)
-        h_humid = font.render(data.humidity[rv] + '%', True, self._line_color)
-        baro_label = font.render('Pressure (inHg)', True, self._line_color)
-        c_baro = font.render(data.baro[c], True, self._line_color)
-        h_baro = font.render(data.baro[rv], True, self._line_color)
-        wind_label = font.render('Speed (mph)', True, self._line_color)
-        c_wind_speed = font.render(data.wind_speed[c], True, self._line_color)
-        h_wind_speed = font.render(data.wind_speed[rv], True, self._line_color)
-        wind_dir_label = font.render('Direction', True, self._line_color)
-        c_wind_direction = font.render(data.wind_direction_deg[c] + chr(0x00B0), True, self._line_color)
-        h_wind_direction = font.render(data.wind_direction_deg[rv] + chr(0x00B0), True, self._line_color)
-        li_label = font.render('Lumens', True, self._line_color)
-        c_lumen = font.render(data.lumen, True, self._line_color)
-        h_lumen = font.render('N/A', True, self._line_color)
+        curr = self.__render_label(lgfont, 'Current')
+        hist = self.__render_label(lgfont, hist_view[1])
+        hist_time = self.__render_label(smfont, hist_view_time[0])
+        labels = [self.__render_label(font, 'Temp ({}):'.format(cf[1])),
+                  self.__render_label(font, 'Humidity (RH):'),
+                  self.__render_label(font, 'Pressure (inHg)'),
+                  self.__render_label(font, 'Speed (mph)'),
+                  self.__render_label(font, 'Direction'),
+                  self.__render_label(font, 'Lumens')]
+        h_lumen = self.__render_label(font, 'N/A')
 
         # Draw header
         (cx, cy) = curr.get_size()
         (hx, hy) = hist.get_size()
-        self._screen.blit(curr, (lc - cx / 2, yt + offset))
-        self._screen.blit(hist, (rc - hx / 2, yt + offset))
+        surface.blit(curr, (lc - cx / 2, yh))
+        surface.blit(hist, (rc - hx / 2, yh))
 
         # Draw sub-header
         (htx, hty) = hist_time.get_size()
-        (tx, ty) = trend.get_size()
-        self._screen.blit(hist_time, (rc - htx / 2, yt + cy + offset))
-        # self._screen.blit(trend, (((rc - xc) / 2) + xc - tx / 2, yt + cy + offset))
-
-        # Draw temp
-        (ctx, cty) = c_temp.get_size()
-        (htx, hty) = h_temp.get_size()
-        self._screen.blit(temp_label, (xl + offset, yt + bo + cy + ty + text_border))
-        self._screen.blit(c_temp, (lc - ctx / 2, yt + bo + cy + ty + text_border))
-        self._screen.blit(h_temp, (rc - htx / 2, yt + bo + cy + ty + text_border))
-
-        # Draw humidity
-        (chx, chy) = c_humid.get_size()
-        (hhx, hhy) = h_humid.get_size()
-        self._screen.blit(humid_label, (xl + offset, yt + bo + cy + ty + cty + text_border))
-        self._screen.blit(c_humid, (lc - chx / 2, yt + bo + cy + ty + cty + text_border))
-        self._screen.blit(h_humid, (rc - hhx / 2, yt + bo + cy + ty + hty + text_border))
-
-        # Draw Barometric Pressure
-        (cbx, cby) = c_baro.get_size()
-        (hbx, hby) = h_baro.get_size()
-        self._screen.blit(baro_label, (xl + offset, yt + bo + cy + ty + cty + chy + text_border))
-        self._screen.blit(c_baro, (lc - cbx / 2, yt + bo + cy + ty + cty + chy + text_border))
-        self._screen.blit(h_baro, (rc - hbx / 2, yt + bo + cy + ty + hty + hhy + text_border))
-
-        # Draw wind speed
-        (cwsx, cwsy) = c_wind_speed.get_size()
-        (hwsx, hwsy) = h_wind_speed.get_size()
-        self._screen.blit(wind_label, (xl + offset, yt + bo + cy + ty + cty + chy + cby + text_border))
-        self._screen.blit(c_wind_speed, (lc - cwsx / 2, yt + bo + cy + ty + cty + chy + cby + text_border))
-        self._screen.blit(h_wind_speed, (rc - hwsx / 2, yt + bo + cy + ty + hty + hhy + hby + text_border))
-
-        # Draw wind direction
-        (cwdx, cwdy) = c_wind_direction.get_size()
-        (hwdx, hwdy) = h_wind_direction.get_size()
-        self._screen.blit(wind_dir_label, (xl + offset, yt + bo + cy + ty + cty + chy + cby + cwsy + text_border))
-        self._screen.blit(c_wind_direction, (lc - cwdx / 2, yt + bo + cy + ty + cty + chy + cby + cwsy + text_border))
-        self._screen.blit(h_wind_direction, (rc - hwdx / 2, yt + bo + cy + ty + hty + hhy + hby + hwsy + text_border))
-
-        # Draw light index
-        (clx, cly) = c_lumen.get_size()
+        surface.blit(hist_time, (rc - htx / 2, yh + cy))
+
+        # Draw row labels
+        rows = self._layout.detail_rows
+        for (label, y) in zip(labels, rows):
+            surface.blit(label, (xl, y))
+
+        # Lumens have no history yet
         (hlx, hly) = h_lumen.get_size()
-        self._screen.blit(li_label, (xl + offset, yt + bo + cy + ty + cty + chy + cby + cwsy + cwdy + text_border))
-        self._screen.blit(c_lumen, (lc - clx / 2, yt + bo + cy + ty + cty + chy + cby + cwsy + cwdy + text_border))
-        self._screen.blit(h_lumen, (rc - hlx / 2, yt + bo + cy + ty + hty + hhy + hby + hwsy + hwdy + text_border))
+        surface.blit(h_lumen, (rc - hlx / 2, rows[5]))
+
+    def __display_sensor_detail_data(self):
+
+        data = self._station
+        h = ['hour', 'day', 'week', 'month', 'year']
+        current = data.observation
+        history = data.history[h[0]]
+        degree = chr(0x00B0)
+
+        lc = self._layout.points['detail.current_x']
+        rc = self._layout.points['detail.history_x']
+
+        font = self._fonts.get(DETAIL_TEXT['row'])
+
+        # Current and history values for each row, top to bottom
+        values = [(current.text('temp', degree), history.text('temp', degree)),
+                  (current.text('humidity', '%'), history.text('humidity', '%')),
+                  (current.text('baro'), history.text('baro')),
+                  (current.text('wind_speed'), history.text('wind_speed')),
+                  (current.text('wind_direction_deg', degree), history.text('wind_direction_deg', degree)),
+                  (current.text('lumen'), None)]
+
+        for ((current, history), y) in zip(values, self._layout.detail_rows):
+            c_val = self._text.render(font, current, self._line_color)
+            self._screen.blit(c_val, (lc - c_val.get_width() / 2, y))
+            if history is not None:
+                h_val = self._text.render(font, history, self._line_color)
+                self._screen.blit(h_val, (rc - h_val.get_width() / 2, y))
 
     def display_start(self):
         """display_start is the main initializer for the display it makes calls to many other
@@ -537,79 +616,188 @@ class DisplayDriver:
             print(str(err))
             quit()
 
-    def update_diplay(self):
+    def update_diplay(self, now=None):
+        """Draws one frame.  now is a time.struct_time to draw the clock with, it defaults to the local time."""
         try:
-            self.__draw_frames()
-            self.__display_datetime()
-            self.__display_connected()
-            self.__display_connected()
-            self.__display_forecasts()
-            self.__weather_vane()
-            self.__display_indoor()
-            self.__display_left_frame()
-            self.__display_sensor_detail_data()
-            self.__display_feels_like()
-            self.__render_screen()
-            self.__display_wind_avg()
-            pygame.display.update()
+            self._now = now or time.localtime()
+            if self._full_redraw:
+                self.__build_clock_glyphs()
+                self.__draw_frames()
+                self.__draw_panels()
+                self._full_redraw = False
+                with self.__timer('render.flip'):
+                    pygame.display.update()
+            else:
+                dirty = self.__draw_panels()
+                if dirty:
+                    with self.__timer('render.flip'):
+                        pygame.display.update(dirty)
         except AssertionError as err:
             print("Update Error + {}".format(str(err)))
 
+    def render_stats(self):
+        """Returns the cache counters for the render path.  In steady state the misses should stop growing."""
+        return {'fonts': self._fonts.stats(), 'icons': self._icon_cache.stats(), 'text': self._text.stats(),
+                'surfaces_created': self._surfaces_created}
+
+    def timing_stats(self):
+        """Returns the rolling phase timings and recent loop stalls, or None when no instrumentation is attached."""
+        if self._instrumentation:
+            return self._instrumentation.snapshot()
+        return None
+
     def update_daily_data(self):
         try:
-            self._system_data.forecasts.update_forecast_data()
-            self._system_data.forecasts.update_forecasts()
+            with self.__timer('data.daily'):
+                self._system_data.forecasts.update_forecast_data()
         except ConnectionError as e:
             raise ConnectionError(e)
 
     def update_current_data(self):
         try:
-            self._system_data.ws.update_station()
+            with self.__timer('data.current'):
+                self._system_data.ws.update_station()
         except ConnectionError as e:
             raise ConnectionError(e)
 
-    def update_indoor_data(self, interval):
-        cnt = interval
-        while self.running:
-            if cnt == interval:
-                self._system_data.indoor.update_indoor()
-                cnt = 0
-            else:
-                cnt += 1
-            pygame.time.wait(1000)
+    def update_indoor_data(self):
+        with self.__timer('sensor.indoor'):
+            self._system_data.indoor.update_indoor()
+
+    def __fetch_done(self, name):
+        # Runs on the fetch worker; the result itself is picked up by the main loop
+        pygame.event.post(pygame.event.Event(DATA_EVENT, source=name))
+
+    def __timed(self, phase, func):
+        def timed():
+            with self.__timer(phase):
+                return func()
+        return timed
+
+    def __current_job(self):
+        locations = self._system_data.locations
+        if self._run_delay is None:
+            # Spread what is left of today's request budget over the rest of the day; each run costs one request
+            # per location
+            self._scheduler.set_period('current', shared_budget().plan_interval() * len(locations))
+        for location in locations:
+            station = self._system_data.stations[location]
+            self._fetcher.submit(('current', location), self.__timed('data.current', station.fetch_station))
+
+    def __daily_job(self):
+        for location in self._system_data.forecasts_due():
+            forecasts = self._system_data.forecast_sets[location]
+            self._fetcher.submit(('daily', location), self.__timed('data.daily', forecasts.fetch_forecast_data))
+
+    def __indoor_job(self):
+        self._fetcher.submit('indoor', self.__timed('sensor.indoor', self._system_data.indoor.read_indoor))
+
+    def __rotate_job(self):
+        self._system_data.rotate()
+        pygame.event.post(pygame.event.Event(DATA_EVENT, source='rotate'))
+
+    def __apply_results(self):
+        """Stores the results of finished fetches.  Runs on the main loop, so the panels never see a half applied
+        update, and never waits: anything still in flight is picked up on a later wake."""
+        for (name, result, error) in self._fetcher.collect():
+            if name == 'indoor':
+                if error is None:
+                    self._system_data.indoor.apply_indoor(result)
+                else:
+                    print("Indoor sensor read failed: {}".format(str(error)))
+                continue
 
-    def main_loop(self, run_delay):
-        cnt = run_delay
+            (job, location) = name
+            if job == 'current':
+                if error is None:
+                    self._system_data.stations[location].apply_station(result)
+                else:
+                    print("No connection on current data update for {}/{}".format(*location))
+                    self._scheduler.retry(job)
+            elif job == 'daily':
+                if error is None and result is not None:
+                    self._system_data.forecast_sets[location].apply_forecast_data(result)
+                    self._system_data.forecast_dates[location] = time.strftime("%d/%m")
+                else:
+                    self._system_data.forecast_dates[location] = None
+                    print("No connection on daily data update for {}/{}.".format(*location))
+                    self._scheduler.retry(job)
+
+    def __handle_event(self, event):
+        """Handles one pygame event and returns True when the display should be redrawn right away."""
+        if event.type == pygame.QUIT:
+            self.running = False
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                self.running = False
+            elif event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                self._system_data.rotate(1 if event.key == pygame.K_RIGHT else -1)
+                return True
+        elif event.type == pygame.VIDEORESIZE:
+            self.__resize(event.size)
+            return True
+        elif event.type == DATA_EVENT:
+            self.__apply_results()
+            return True
+        return False
+
+    def __wait(self, until):
+        """Sleeps until the wall clock reaches until or an event arrives, then returns the pending events."""
+        timeout = int((until - time.time()) * 1000) + 1
+        if timeout <= 0:
+            return pygame.event.get()
+        event = pygame.event.wait(timeout)
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def main_loop(self):
+        """Wakes on each wall clock second, when a scheduled job is due or when an event is posted.  The clock is
+        drawn as soon as the second turns over and due jobs hand their fetches to the worker pool after it, so
+        nothing in the loop waits on the network or the sensors."""
+        drawn_second = None
 
         while self.running:
-            pygame.time.wait(1000)
-            self.update_diplay()
-            cnt += 1
-            if cnt >= run_delay:
-                try:
-                    self.update_current_data()
-                    cnt = 0
-                except ConnectionError as e:
-                    print("No connection on current data update")
-                    cnt = run_delay
-            if time.strftime("%d/%m") != self._system_data.current_date:
-                try:
-                    self.update_daily_data()
-                    self._system_data.current_date = time.strftime("%d/%m")
-                except ConnectionError as e:
-                    self._system_data.current_date = None
-                    print("No connection on daily data update.")
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self.running = False
-
-    def run(self, run_delay=209, interval=60):
+            next_second = (drawn_second + 1) if drawn_second is not None else time.time()
+            next_job = self._scheduler.next_due()
+            until = min(next_second, next_job) if next_job is not None else next_second
+            events = self.__wait(until)
+
+            if self._instrumentation:
+                self._instrumentation.begin_iteration()
+            redraw = False
+            for event in events:
+                redraw = self.__handle_event(event) or redraw
+            now = time.time()
+            if redraw or int(now) != drawn_second:
+                drawn_second = int(now)
+                with self.__timer('render'):
+                    self.update_diplay(time.localtime(drawn_second))
+            self._scheduler.run_pending()
+            if self._instrumentation:
+                self._instrumentation.end_iteration()
+
+    def scheduler_stats(self):
+        return {'jobs': self._scheduler.stats(), 'fetches': self._fetcher.stats(), 'http': shared_client().stats(),
+                'budget': shared_budget().stats(), 'cache': shared_cache().stats()}
+
+    def run(self, run_delay=None, interval=60, daily_check=60, retry_delay=30, rotate_period=None):
+        """Starts the display and runs the main loop.  Argument descriptions: run_delay is the number of
+        seconds between current condition updates, by default it is planned from the API request
+        budget; interval is the number of seconds between indoor sensor reads; daily_check is how
+        often to check whether the forecast needs its daily update; retry_delay is how long to wait
+        before retrying a failed update; rotate_period, if set, is the number of seconds each
+        location is shown before moving to the next.  The left and right keys also switch location."""
         self.display_start()
-        t1 = threading.Thread(target=self.update_indoor_data, args=(interval,))
-        t1.start()
-        self.main_loop(run_delay)
-        t1.join()
+        self._run_delay = run_delay
+        current_period = run_delay or shared_budget().plan_interval() * len(self._system_data.locations)
+        self._scheduler.add('current', current_period, self.__current_job, jitter=1.0, retry=retry_delay)
+        self._scheduler.add('daily', daily_check, self.__daily_job, jitter=1.0, retry=retry_delay)
+        self._scheduler.add('indoor', interval, self.__indoor_job, deadline=interval / 2)
+        if rotate_period and len(self._system_data.locations) > 1:
+            self._scheduler.add('rotate', rotate_period, self.__rotate_job, first_run=rotate_period)
+        try:
+            self.main_loop()
+        finally:
+            self._fetcher.shutdown()
         pygame.quit()
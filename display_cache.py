@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import pygame
+
+DEFAULT_ICON_CACHE_BYTES = 8 * 1024 * 1024
+DEFAULT_TEXT_CACHE_ENTRIES = 256
+
+
+class FontRegistry:
+    def __init__(self, family, height):
+        """FontRegistry hands out shared pygame Font objects for the display.  Fonts are
+        requested as a fraction of the screen height and resolved once per (family, pixel
+        size, bold) for the current resolution; calling resize with a new height drops
+        them so they are rebuilt at the new size.
+        """
+        self._family = family
+        self._height = height
+        self._fonts = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scale, bold=True, family=None):
+        key = (family or self._family, int(self._height * scale), bool(bold))
+        font = self._fonts.get(key)
+        if font is None:
+            self.misses += 1
+            font = pygame.font.SysFont(key[0], key[1], bold=key[2])
+            self._fonts[key] = font
+        else:
+            self.hits += 1
+        return font
+
+    def resize(self, height):
+        if height != self._height:
+            self._height = height
+            self._fonts.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'fonts': len(self._fonts), 'hits': self.hits, 'misses': self.misses}
+
+
+class IconCache:
+    def __init__(self, max_bytes=DEFAULT_ICON_CACHE_BYTES):
+        """IconCache keeps loaded icons ready to blit.  Entries are keyed by (path, target size);
+        each file is loaded, converted and scaled once.  When the surfaces held exceed max_bytes
+        the least recently used entries are evicted.  The target size of each (path, scale) is
+        remembered, so a scaled icon is found in one lookup without keeping its original.
+        """
+        self._max_bytes = max_bytes
+        self._surfaces = OrderedDict()
+        self._scaled_sizes = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, size=None, scale=None):
+        original = None
+        if scale is not None:
+            size = self._scaled_sizes.get((path, scale))
+            if size is None:
+                original = self._original(path)
+                (ix, iy) = original.get_size()
+                size = self._scaled_sizes[(path, scale)] = (int(ix * scale), int(iy * scale))
+        key = (path, size)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        if size is None:
+            surface = pygame.image.load_extended(path).convert_alpha()
+        else:
+            surface = pygame.transform.scale(original or self._original(path), size)
+        self._store(key, surface)
+        return surface
+
+    def _original(self, path):
+        """Returns the icon at its own size, from the cache if it is there, without storing it or counting a
+        lookup."""
+        surface = self._surfaces.get((path, None))
+        return surface if surface is not None else pygame.image.load_extended(path).convert_alpha()
+
+    def _store(self, key, surface):
+        self._surfaces[key] = surface
+        self._bytes += self._surface_bytes(surface)
+        while self._bytes > self._max_bytes and len(self._surfaces) > 1:
+            (_, old) = self._surfaces.popitem(last=False)
+            self._bytes -= self._surface_bytes(old)
+            self.evictions += 1
+
+    @staticmethod
+    def _surface_bytes(surface):
+        (x, y) = surface.get_size()
+        return x * y * surface.get_bytesize()
+
+    def clear(self):
+        self._surfaces.clear()
+        self._scaled_sizes.clear()
+        self._bytes = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {'icons': len(self._surfaces), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class TextCache:
+    def __init__(self, max_entries=DEFAULT_TEXT_CACHE_ENTRIES):
+        """TextCache holds rendered text surfaces keyed by (font, text, color) so a value that has not
+        changed is not rasterised again.  The least recently used surfaces are dropped once more than
+        max_entries are held.  Fonts are part of the key, so clear the cache when the fonts are rebuilt.
+        """
+        self._max_entries = max_entries
+        self._surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self._max_entries:
+            self._surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {'surfaces': len(self._surfaces), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hit_rate()}
+
+
+class GlyphAtlas:
+    def __init__(self, font, color, chars='0123456789:'):
+        """GlyphAtlas pre-renders each character in chars once so strings made only of those
+        characters can be composed by blitting cached glyphs instead of rasterising the string.
+        """
+        self._glyphs = {char: font.render(char, True, color) for char in chars}
+        self._height = font.get_height()
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    def size(self, text):
+        return sum(self._glyphs[char].get_width() for char in text), self._height
+
+    def blit(self, surface, text, pos):
+        (x, y) = pos
+        for char in text:
+            glyph = self._glyphs[char]
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
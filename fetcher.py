@@ -0,0 +1,63 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Fetcher:
+    def __init__(self, workers=2, on_done=None):
+        """Fetcher runs blocking fetches on a small thread pool so the render loop never waits on I/O.
+        Each job is identified by name and only one fetch per name is in flight at a time.  Finished
+        results are queued until the owner calls collect from its own thread; on_done, if given, is
+        called from the worker thread with the job name as soon as a result is queued.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch')
+        self._on_done = on_done
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._done = deque()
+        self.submitted = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def submit(self, name, func, *args):
+        """Starts func(*args) on a worker.  Returns False without starting it if name is still in flight."""
+        with self._lock:
+            if name in self._in_flight:
+                self.skipped += 1
+                return False
+            self._in_flight.add(name)
+            self.submitted += 1
+        self._executor.submit(self._run, name, func, args)
+        return True
+
+    def _run(self, name, func, args):
+        try:
+            result = (func(*args), None)
+        except Exception as e:
+            result = (None, e)
+        with self._lock:
+            self._in_flight.discard(name)
+            self._done.append((name,) + result)
+            if result[1] is not None:
+                self.failed += 1
+        if self._on_done:
+            self._on_done(name)
+
+    def collect(self):
+        """Returns the (name, result, error) of every fetch that finished since the last call, oldest first."""
+        with self._lock:
+            done = list(self._done)
+            self._done.clear()
+        return done
+
+    def busy(self, name):
+        with self._lock:
+            return name in self._in_flight
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': sorted(self._in_flight), 'submitted': self.submitted, 'skipped': self.skipped,
+                    'failed': self.failed}
@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from api_cache import BudgetExceededError
+from instrumentation import RollingHistogram
+
+DEFAULT_TIMEOUT = (5, 15)
+RETRY_STATUS = (500, 502, 503, 504)
+
+# Too Many Requests: retried only when the server says how long to wait, and not if that is longer than backoff_cap
+RATE_LIMITED = 429
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class HttpClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5, backoff_cap=8.0, failure_threshold=5,
+                 cooldown=300.0, pool_size=4):
+        """HttpClient is the shared connection pool for the weather API.  Connections are kept alive
+        between calls and responses are requested gzip compressed.  A failed request is retried up to
+        retries times with exponential backoff (backoff, doubled each attempt, capped at backoff_cap)
+        and full jitter; a rate limited one only after the wait its Retry-After header asks for.  After
+        failure_threshold requests in a row have failed, the circuit opens and calls fail fast with
+        CircuitOpenError for cooldown seconds; one trial request is then let through to close it again.
+        """
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._backoff_cap = backoff_cap
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update({'Accept-Encoding': 'gzip'})
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._latency = RollingHistogram()
+        self.requests = 0
+        self.failures = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def _check_circuit(self):
+        with self._lock:
+            if self._consecutive_failures < self._failure_threshold:
+                return
+            if time.monotonic() < self._open_until:
+                self.rejected += 1
+                raise CircuitOpenError('Circuit open after {} failures'.format(self._consecutive_failures))
+            # Half open: let this request through, and hold the others off until it has finished
+            self._open_until = time.monotonic() + self._cooldown
+
+    def _record(self, ok, seconds=None):
+        with self._lock:
+            if seconds is not None:
+                self._latency.add(seconds)
+            if ok:
+                self._consecutive_failures = 0
+                return
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self._failure_threshold:
+                self._open_until = time.monotonic() + self._cooldown
+
+    def _sleep(self, attempt):
+        delay = min(self._backoff_cap, self._backoff * 2 ** attempt)
+        time.sleep(random.uniform(0, delay))
+
+    def _retry_after(self, response):
+        """Returns the seconds a rate limited response asks to wait before retrying, or None if it should not be
+        retried."""
+        try:
+            delay = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+        return delay if 0 <= delay <= self._backoff_cap else None
+
+    def request(self, method, url, timeout=None, acquire=None, **kwargs):
+        """Sends the request and returns the response.  acquire, if given, is called before every attempt,
+        retries included, and the request fails with BudgetExceededError as soon as it returns False.  Raises
+        ConnectionError (or Timeout) once the retries are used up, and CircuitOpenError while the breaker is
+        open."""
+        self._check_circuit()
+        attempt = 0
+        while True:
+            if acquire is not None and not acquire():
+                raise BudgetExceededError('Request budget spent for {}'.format(url))
+            with self._lock:
+                self.requests += 1
+            start = time.monotonic()
+            try:
+                response = self._session.request(method, url, timeout=timeout or self._timeout, **kwargs)
+            except (ConnectionError, Timeout):
+                self._record(False)
+                if attempt >= self._retries:
+                    raise
+            else:
+                if response.status_code == RATE_LIMITED:
+                    # The server is up, so this does not count towards opening the circuit
+                    self._record(True, time.monotonic() - start)
+                    delay = self._retry_after(response)
+                    if delay is None or attempt >= self._retries:
+                        return response
+                    with self._lock:
+                        self.retried += 1
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                if response.status_code not in RETRY_STATUS:
+                    self._record(True, time.monotonic() - start)
+                    return response
+                self._record(False, time.monotonic() - start)
+                if attempt >= self._retries:
+                    return response
+            with self._lock:
+                self.retried += 1
+            self._sleep(attempt)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'failures': self.failures, 'retried': self.retried,
+                    'rejected': self.rejected, 'consecutive_failures': self._consecutive_failures,
+                    'circuit_open': (self._consecutive_failures >= self._failure_threshold and
+                                     time.monotonic() < self._open_until),
+                    'latency': self._latency.stats()}
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    """Returns the process wide HttpClient, creating it on first use."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
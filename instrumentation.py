@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_WINDOW = 300
+DEFAULT_BUDGET = 1.0
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class RollingHistogram:
+    def __init__(self, window=DEFAULT_WINDOW):
+        """RollingHistogram keeps the last window durations recorded for one phase."""
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def stats(self):
+        ordered = sorted(self._samples)
+        return {'count': self.count, 'last': self._samples[-1] if self._samples else 0.0,
+                'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95), 'p99': percentile(ordered, 99),
+                'max': ordered[-1] if ordered else 0.0}
+
+
+class Instrumentation:
+    def __init__(self, budget=DEFAULT_BUDGET, window=DEFAULT_WINDOW, log=print):
+        """Instrumentation times named phases into rolling histograms and watches main loop iterations.
+        Wrap work in timer(phase) from any thread.  The main loop calls begin_iteration and
+        end_iteration; an iteration that takes longer than budget seconds is logged with the phases
+        that ran during it, slowest first, including phases still running on other threads.
+        """
+        self._budget = budget
+        self._window = window
+        self._log = log
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._active = {}
+        self._finished = deque(maxlen=window)
+        self._iteration_start = None
+        self.stalls = deque(maxlen=50)
+
+    @contextmanager
+    def timer(self, phase):
+        key = (phase, threading.get_ident())
+        start = time.perf_counter()
+        with self._lock:
+            self._active[key] = start
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self._active.pop(key, None)
+                self._histogram(phase).add(end - start)
+                self._finished.append((phase, start, end))
+
+    def _histogram(self, phase):
+        histogram = self._histograms.get(phase)
+        if histogram is None:
+            histogram = RollingHistogram(self._window)
+            self._histograms[phase] = histogram
+        return histogram
+
+    def begin_iteration(self):
+        self._iteration_start = time.perf_counter()
+
+    def end_iteration(self):
+        if self._iteration_start is None:
+            return None
+        start = self._iteration_start
+        end = time.perf_counter()
+        self._iteration_start = None
+        elapsed = end - start
+        with self._lock:
+            self._histogram('loop').add(elapsed)
+            if elapsed <= self._budget:
+                return None
+            phases = {}
+            for (phase, p_start, p_end) in self._finished:
+                overlap = min(p_end, end) - max(p_start, start)
+                if overlap > 0:
+                    phases[phase] = phases.get(phase, 0.0) + overlap
+            for ((phase, _), p_start) in self._active.items():
+                phases[phase] = phases.get(phase, 0.0) + end - max(p_start, start)
+
+        ranked = sorted(phases.items(), key=lambda item: item[1], reverse=True)
+        stall = {'time': time.time(), 'elapsed': elapsed, 'phases': ranked}
+        self.stalls.append(stall)
+        culprit = ranked[0][0] if ranked else 'unknown'
+        self._log('Loop stall: {:.3f}s over a {:.3f}s budget, slowest phase {} ({})'.format(
+            elapsed, self._budget, culprit, ', '.join('{} {:.3f}s'.format(p, s) for (p, s) in ranked[:5])))
+        return stall
+
+    def snapshot(self):
+        with self._lock:
+            return {'phases': {phase: h.stats() for (phase, h) in self._histograms.items()},
+                    'active': sorted(phase for (phase, _) in self._active),
+                    'stalls': list(self.stalls)}
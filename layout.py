@@ -0,0 +1,148 @@
+import pygame
+
+# Frame line positions as fractions of the drawable area
+FRAME_HZ = (0.1, 0.5, 0.58)
+FRAME_VT = (0.33, 0.66)
+
+FORECAST_DAYS = (3, 5, 7)
+
+# Text heights, as fractions of the drawable height, for the panels laid out in rows and columns
+FORECAST_TEXT = {'day': 0.045, 'rain': 0.08}
+DETAIL_TEXT = {'header': 0.035, 'sub_header': 0.024, 'row': 0.031}
+DETAIL_ROWS = 6
+
+
+class Layout:
+    def __init__(self, size, borders, fonts, forecast_days=5):
+        """Layout holds the geometry of the display: the frame lines, the rect of each panel and the
+        anchor points the panels draw their text around.  Everything is computed once for a screen
+        size; call resize when the window changes and read the results from the attributes.
+        Argument descriptions: size is the (x, y) size of the screen; borders is the (x, y) border
+        width; fonts is the FontRegistry used to measure text heights; forecast_days is the number
+        of forecast columns and must be one of FORECAST_DAYS.
+        """
+        if forecast_days not in FORECAST_DAYS:
+            raise ValueError('forecast_days must be one of {}'.format(FORECAST_DAYS))
+
+        self._borders = borders
+        self._fonts = fonts
+        self.forecast_days = forecast_days
+        self.size = None
+        self.xmax = 0
+        self.ymax = 0
+        self.lines = []
+        self.rects = {}
+        self.points = {}
+        self.forecast_columns = []
+        self.detail_rows = []
+        self.resize(size)
+
+    def resize(self, size):
+        if size == self.size:
+            return False
+        self.size = tuple(size)
+        self.xmax = self.size[0] - self._borders[0]
+        self.ymax = self.size[1] - self._borders[1]
+        self._fonts.resize(self.ymax)
+        self._build_lines()
+        self._build_rects()
+        self._build_points()
+        self._build_forecasts()
+        self._build_detail_rows()
+        return True
+
+    def _build_lines(self):
+        xmin = self._borders[0]
+        ymin = self._borders[1]
+        xmax = self.xmax
+        ymax = self.ymax
+        hz = FRAME_HZ
+        vt = FRAME_VT
+
+        # Screen border
+        self.lines = [((xmin, xmin), (xmax, xmin)),   # Top
+                      ((xmin, xmin), (xmin, ymax)),   # Left
+                      ((xmin, ymax), (xmax, ymax)),   # Bottom
+                      ((xmax, ymin), (xmax, ymax))]   # Right Edge
+
+        # Horizontal lines
+        self.lines += [((xmin, ymax * h), (xmax, ymax * h)) for h in hz]
+
+        # Vertical lines between the upper panels
+        self.lines += [((xmax * v, ymax * hz[2]), (xmax * v, ymax * hz[0])) for v in vt]
+
+        # Vertical lines between the forecast days
+        self.lines += [((xmax * j / self.forecast_days, ymax), (xmax * j / self.forecast_days, ymax * hz[2]))
+                       for j in range(1, self.forecast_days)]
+
+    def _build_rects(self):
+        hz = FRAME_HZ
+        vt = FRAME_VT
+        xs = (0, int(self.xmax * vt[0]), int(self.xmax * vt[1]), self.size[0])
+        ys = (0, int(self.ymax * hz[0]), int(self.ymax * hz[1]), int(self.ymax * hz[2]), self.size[1])
+
+        def rect(x0, y0, x1, y1):
+            return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+
+        self.rects = {'header': rect(xs[0], ys[0], xs[3], ys[1]),
+                      'left': rect(xs[0], ys[1], xs[1], ys[2]),
+                      'vane': rect(xs[1], ys[1], xs[2], ys[2]),
+                      'detail': rect(xs[2], ys[1], xs[3], ys[2]),
+                      'indoor': rect(xs[0], ys[2], xs[1], ys[3]),
+                      'wind_avg': rect(xs[1], ys[2], xs[2], ys[3]),
+                      'feels_like': rect(xs[2], ys[2], xs[3], ys[3]),
+                      'forecasts': rect(xs[0], ys[3], xs[3], ys[4])}
+
+    def _build_points(self):
+        xmax = self.xmax
+        ymax = self.ymax
+        hz = FRAME_HZ
+        vt = FRAME_VT
+        xl = self._borders[0]
+        centering = xmax * .085
+        upper_yc = ((ymax * hz[1] - ymax * hz[0]) / 2) + (ymax * hz[0])
+
+        self.points = {
+            # Header
+            'clock': (xmax / 2, 10),
+            'clock_seconds_y': 15,
+            'date': (xmax - self._borders[1] * 2, 13),
+            'station': (xl * 2, self._borders[1]),
+
+            # Upper row
+            'vane': (xmax * 0.5, upper_yc),
+            'left.temp': (xl + centering, upper_yc),
+            'left.humidity': (xmax * vt[0] - centering, upper_yc),
+            'detail.label_x': xmax * vt[1] + ymax * .022,
+            'detail.current_x': xmax * vt[1] + xmax * .088 * 2,
+            'detail.history_x': xmax - xmax * .055,
+            'detail.header_y': ymax * hz[0] + ymax * .022,
+
+            # Middle row; labels hang from the top line and values sit on the bottom line
+            'middle.top': ymax * hz[1],
+            'middle.bottom': ymax * hz[2],
+            'indoor.name_x': (xmax * vt[0]) / 2,
+            'indoor.temp_x': xl + ymax * .03,
+            'indoor.humidity_x': xmax * vt[0] - ymax * .03,
+            'wind_avg.gust_x': xmax * vt[0] + centering,
+            'wind_avg.avg_x': xmax * vt[1] - centering,
+            'feels_like.heat_index_x': xmax * vt[1] + centering,
+            'feels_like.wind_chill_x': xmax - centering,
+
+            # Forecast strip
+            'forecast.top': ymax * hz[2] + 5,
+            'forecast.bottom': ymax,
+        }
+
+    def _build_forecasts(self):
+        width = 1 / self.forecast_days
+        self.forecast_columns = [self.xmax * (width / 2 + j * width) for j in range(self.forecast_days)]
+
+    def _build_detail_rows(self):
+        offset = self.ymax * .022
+        text_border = self.ymax * .004
+        cy = self._fonts.get(DETAIL_TEXT['header']).get_height()
+        ty = self._fonts.get(DETAIL_TEXT['sub_header']).get_height()
+        fy = self._fonts.get(DETAIL_TEXT['row']).get_height()
+        top = self.ymax * FRAME_HZ[0] + offset * 2 + cy + ty + text_border
+        self.detail_rows = [top + fy * j for j in range(DETAIL_ROWS)]
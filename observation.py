@@ -0,0 +1,92 @@
+import time
+from functools import lru_cache
+from types import MappingProxyType
+
+# Unit of each observed quantity, as the weather sources report them
+IMPERIAL = MappingProxyType({'temp': 'f', 'humidity': '%', 'baro': 'inHg', 'rain': 'in', 'wind_speed': 'mph',
+                             'wind_direction_deg': 'deg', 'wind_gust': 'mph', 'wind_avg': 'mph', 'lumen': 'lm',
+                             'heat_index': 'f', 'wind_chill': 'f'})
+
+# Decimal places each quantity is shown with
+PLACES = {'temp': 1, 'humidity': 0, 'baro': 2, 'rain': 2, 'wind_speed': 0, 'wind_direction_deg': 0, 'wind_gust': 1,
+          'wind_avg': 1, 'lumen': 1, 'heat_index': 0, 'wind_chill': 0}
+
+
+def to_float(value):
+    """Converts a reported value to a float, or None for the placeholders sources use for no reading
+    ('NA', '-', '' or None).  A trailing '%' is ignored."""
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        return float(str(value).rstrip('%'))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=1024)
+def format_value(value, places=1, suffix='', missing='-'):
+    """Formats a reading for display, or returns missing for no reading.  Readings change far less often than
+    frames are drawn, so the strings are memoised."""
+    if value is None:
+        return missing
+    return '{:.{}f}{}'.format(value, places, suffix)
+
+
+class Observation:
+    __slots__ = ('time', 'temp', 'humidity', 'baro', 'rain', 'wind_speed', 'wind_direction_deg', 'wind_gust',
+                 'wind_avg', 'lumen', 'heat_index', 'wind_chill', 'units')
+
+    fields = __slots__[1:-1]
+
+    def __init__(self, time=None, units=IMPERIAL, **values):
+        """Observation is an immutable set of readings taken at one time.  Argument descriptions: time is
+        the epoch seconds the readings were taken at; units maps each quantity to its unit; values are the
+        readings as floats, keyed by quantity, and any quantity not given is None (no reading).
+        """
+        unknown = set(values) - set(self.fields)
+        if unknown:
+            raise TypeError('Unknown quantities: {}'.format(', '.join(sorted(unknown))))
+        set_field = object.__setattr__
+        set_field(self, 'time', time)
+        set_field(self, 'units', units)
+        for field in self.fields:
+            set_field(self, field, values.get(field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Observation is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Observation is immutable')
+
+    def values(self):
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def __eq__(self, other):
+        if not isinstance(other, Observation):
+            return NotImplemented
+        return self.values() == other.values() and self.units == other.units
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __repr__(self):
+        return 'Observation({})'.format(', '.join('{}={}'.format(field, getattr(self, field))
+                                                    for field in self.fields if getattr(self, field) is not None))
+
+    def replace(self, **values):
+        """Returns a copy with the given readings changed."""
+        merged = {field: getattr(self, field) for field in self.fields}
+        merged.update(values)
+        return Observation(time=merged.pop('time', self.time), units=self.units, **merged)
+
+    def text(self, field, suffix='', missing='-'):
+        """Returns the named reading formatted for display with its usual number of decimal places."""
+        return format_value(getattr(self, field), PLACES[field], suffix, missing)
+
+    @classmethod
+    def now(cls, **values):
+        return cls(time=time.time(), **values)
+
+
+# An observation with no readings, for stations that have not reported yet
+EMPTY = Observation()
@@ -0,0 +1,395 @@
+import abc
+import datetime as dt
+import json
+import math
+import queue
+import selectors
+import socket
+import struct
+import threading
+
+# Large enough for any UDP payload, so nothing is ever truncated
+MAX_DATAGRAM = 65535
+
+# JSON key of each Reading field
+JSON_KEYS = {'sig_strength': 'RSSI', 'temp': 'Temperature', 'rain': 'Rain', 'baro': 'Pressure',
+             'humidity': 'Humidity', 'wind_speed': 'Wind Speed', 'wind_direction_deg': 'Direction',
+             'lumen': 'Lumens'}
+
+# Binary packets: version, station id, sequence number, then Temperature, Humidity, Pressure, Altitude, Lumens,
+# Wind Speed, Direction, Rain and RSSI, little endian.  38 bytes against about 190 for the same reading in JSON.
+BINARY_VERSION = 1
+
+# Station id of JSON packets that do not carry a "Station" key
+DEFAULT_STATION = 0
+BINARY = struct.Struct('<BHIffffffHfb')
+
+
+class Reading:
+    __slots__ = ('station_id', 'date_time', 'sig_strength', 'temp', 'rain', 'baro', 'humidity', 'wind_speed',
+                 'wind_direction_deg', 'lumen')
+
+    def __init__(self, **values):
+        """Reading is one received reading, with the same fields as a History row but none of the ORM
+        bookkeeping."""
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_history(cls, row):
+        return cls(**{field: getattr(row, field) for field in cls.__slots__})
+
+    def as_row(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def encode_binary(values, station_id=0, sequence=0):
+    """Packs a reading, given as a mapping of JSON keys to values, as a binary packet."""
+    return BINARY.pack(BINARY_VERSION, station_id, sequence & 0xFFFFFFFF, values['Temperature'], values['Humidity'],
+                       values['Pressure'], values.get('Altitude', 0.0), values['Lumens'], values['Wind Speed'],
+                       int(values['Direction']) % 360, values['Rain'], int(values['RSSI']))
+
+
+def decode_packet(data, date_time=None):
+    """Decodes one sensor packet, binary or JSON, and returns (reading, station id, sequence number).  A binary
+    packet is recognised by its version byte and length; anything else is parsed as JSON, which has no sequence
+    number.  Raises ValueError if the packet is not a complete reading."""
+    date_time = date_time or dt.datetime.now()
+    if len(data) == BINARY.size and data[0] == BINARY_VERSION:
+        (version, station_id, sequence, temp, humidity, baro, altitude, lumen, wind_speed, direction, rain,
+         rssi) = BINARY.unpack(data)
+        values = {'sig_strength': rssi, 'temp': temp, 'rain': rain, 'baro': baro, 'humidity': humidity,
+                  'wind_speed': wind_speed, 'wind_direction_deg': direction, 'lumen': lumen}
+    else:
+        (values, station_id, sequence) = _decode_json(data)
+    _check_finite(values)
+    return Reading(station_id=station_id, date_time=date_time, **values), station_id, sequence
+
+
+def _decode_json(data):
+    try:
+        packet = json.loads(data)
+        values = {field: float(packet[key]) for (field, key) in JSON_KEYS.items()}
+        values['sig_strength'] = int(values['sig_strength'])
+        station_id = int(packet.get('Station', DEFAULT_STATION))
+    except (KeyError, TypeError, OverflowError) as e:
+        raise ValueError('Incomplete reading: {}'.format(str(e)))
+    return (values, station_id, None)
+
+
+def _check_finite(values):
+    """Raises ValueError if any reading is NaN or infinite; one would never leave the aggregates' running sums."""
+    if not all(math.isfinite(value) for value in values.values()):
+        raise ValueError('Reading is not finite')
+
+
+def parse_packet(data, date_time=None):
+    """Decodes one sensor packet into a Reading stamped with date_time (default now).  Raises ValueError if the
+    packet is not a complete reading."""
+    return decode_packet(data, date_time)[0]
+
+
+class Receiver(abc.ABC):
+    def __init__(self, queue_size=1000, poll_interval=0.5, name='receiver'):
+        """Receiver is the part of the UDP and TCP receivers they share: a thread, the bounded queue
+        parsed readings wait in for the owner to collect, and the counters.  poll_interval is how often
+        the thread checks for close.
+        """
+        self._poll_interval = poll_interval
+        self._selector = selectors.DefaultSelector()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        # Only the receiving thread writes the counters
+        self.received = 0
+        self.parsed = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.lost = 0
+        self.wakeups = 0
+        self._sequences = {}
+        self.addresses = {}
+        self.lost_by_station = {}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @abc.abstractmethod
+    def _run(self):
+        """Receives until close is called; runs on the receiver's thread."""
+
+    def _decode(self, data, address=None):
+        """Decodes a packet and returns its Reading, or None if it is malformed."""
+        self.received += 1
+        try:
+            (reading, station_id, sequence) = decode_packet(data)
+        except ValueError:
+            self.malformed += 1
+            return None
+        self.parsed += 1
+        self.addresses[station_id] = address
+        if sequence is not None:
+            # Gaps in a station's sequence numbers are packets lost before they reached the socket
+            last = self._sequences.get(station_id)
+            if last is not None and sequence > last + 1:
+                self.lost += sequence - last - 1
+                self.lost_by_station[station_id] = self.lost_by_station.get(station_id, 0) + sequence - last - 1
+            self._sequences[station_id] = sequence
+        return reading
+
+    def readings(self):
+        """Returns every reading received since the last call, oldest first, without waiting."""
+        readings = []
+        while True:
+            try:
+                readings.append(self._queue.get_nowait())
+            except queue.Empty:
+                return readings
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._selector.close()
+
+    def stats(self):
+        return {'received': self.received, 'parsed': self.parsed, 'malformed': self.malformed,
+                'dropped': self.dropped, 'lost': self.lost, 'wakeups': self.wakeups, 'backlog': self._queue.qsize()}
+
+
+class UdpReceiver(Receiver):
+    def __init__(self, address, queue_size=1000, rcvbuf=None, poll_interval=0.5):
+        """UdpReceiver reads sensor packets on its own thread.  Each time the socket becomes readable
+        every datagram waiting in it is read, so a burst, or several stations sending to one port, is
+        never left queued in the kernel.  Parsed readings wait in a queue of at most queue_size for the
+        owner to collect; when it is full new readings are dropped and counted.  rcvbuf, if given, sets
+        the socket's receive buffer size in bytes.
+        """
+        Receiver.__init__(self, queue_size, poll_interval, 'udp-receiver')
+        self._addr = address
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if rcvbuf:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self._sock.setblocking(False)
+        self._sock.bind(address)
+        self._selector.register(self._sock, selectors.EVENT_READ)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._selector.select(self._poll_interval):
+                self.wakeups += 1
+                self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                (data, address) = self._sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if not self._stop.is_set():
+                    print("Receive failed: {}".format(str(e)))
+                return
+            reading = self._decode(data, address)
+            if reading is not None:
+                try:
+                    self._queue.put_nowait(reading)
+                except queue.Full:
+                    self.dropped += 1
+
+    def close(self):
+        Receiver.close(self)
+        self._sock.close()
+
+    def stats(self):
+        stats = Receiver.stats(self)
+        stats['rcvbuf'] = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        return stats
+
+
+class Connection:
+    __slots__ = ('sock', 'address', 'buffer', 'framing', 'paused')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.buffer = bytearray()
+        self.framing = None
+        self.paused = False
+
+
+class TcpReceiver(Receiver):
+    def __init__(self, address, queue_size=1000, max_frame=4096, read_size=65536, backlog=16, poll_interval=0.5):
+        """TcpReceiver accepts long lived connections from stations that stream readings.  Each
+        connection's framing is picked from its first byte: a '{' starts newline delimited JSON,
+        anything else is frames with a 4 byte big endian length prefix, holding JSON or binary packets.
+        Every read takes up to read_size bytes into the connection's buffer and splits out all the
+        complete frames in it; a frame longer than max_frame closes the connection.  When the queue of
+        queue_size readings is full, a connection stops being read until the queue has drained by half,
+        so the sender is slowed down by TCP flow control instead of losing readings.
+        """
+        Receiver.__init__(self, queue_size, poll_interval, 'tcp-receiver')
+        self._addr = address
+        self._max_frame = max_frame
+        self._read_size = read_size
+        self._resume_at = max(queue_size // 2, 1)
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(backlog)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        # Written to by readings() to wake the thread as soon as paused connections can resume
+        (self._wake_reader, self._wake_writer) = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ)
+        self._connections = {}
+        self._paused = []
+        self.accepted = 0
+        self.closed = 0
+        self.pauses = 0
+        self.bytes = 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._paused and self._queue.qsize() <= self._resume_at:
+                self._resume()
+            for (key, events) in self._selector.select(self._poll_interval):
+                self.wakeups += 1
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wake_reader:
+                    self._clear_wake()
+                else:
+                    self._read(key.data)
+        for connection in list(self._connections.values()):
+            self._close(connection)
+
+    def _clear_wake(self):
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                (sock, address) = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print("Accept failed: {}".format(str(e)))
+                return
+            sock.setblocking(False)
+            connection = Connection(sock, address)
+            self._connections[sock.fileno()] = connection
+            self._selector.register(sock, selectors.EVENT_READ, connection)
+            self.accepted += 1
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(self._read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print("Receive from {} failed: {}".format(connection.address, str(e)))
+            data = b''
+        if not data:
+            self._close(connection)
+            return
+        self.bytes += len(data)
+        connection.buffer += data
+        self._frames(connection)
+
+    def _frames(self, connection):
+        """Queues the reading in every complete frame in the connection's buffer.  If the queue fills, stops
+        reading the connection and keeps the rest of the buffer for when it resumes."""
+        buffer = connection.buffer
+        if connection.framing is None and buffer:
+            connection.framing = 'line' if buffer[:1] == b'{' else 'length'
+        start = 0
+        while True:
+            if connection.framing == 'line':
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    if len(buffer) - start > self._max_frame:
+                        break
+                    del buffer[:start]
+                    return
+                frame = bytes(buffer[start:end])
+                following = end + 1
+            else:
+                if len(buffer) - start < 4:
+                    del buffer[:start]
+                    return
+                size = int.from_bytes(buffer[start:start + 4], 'big')
+                if size > self._max_frame:
+                    break
+                if len(buffer) - start - 4 < size:
+                    del buffer[:start]
+                    return
+                frame = bytes(buffer[start + 4:start + 4 + size])
+                following = start + 4 + size
+            if frame.strip():
+                # Only this thread adds to the queue, so a queue that is not full has room for the reading
+                if self._queue.full():
+                    del buffer[:start]
+                    self._pause(connection)
+                    return
+                reading = self._decode(frame, connection.address)
+                if reading is not None:
+                    self._queue.put_nowait(reading)
+            start = following
+        print("Frame over {} bytes from {}, closing".format(self._max_frame, connection.address))
+        self.malformed += 1
+        self._close(connection)
+
+    def _pause(self, connection):
+        if not connection.paused:
+            connection.paused = True
+            self._selector.unregister(connection.sock)
+            self._paused.append(connection)
+            self.pauses += 1
+
+    def _resume(self):
+        paused = self._paused
+        self._paused = []
+        for connection in paused:
+            connection.paused = False
+            self._selector.register(connection.sock, selectors.EVENT_READ, connection)
+            self._frames(connection)
+
+    def _close(self, connection):
+        if connection.paused:
+            self._paused.remove(connection)
+        else:
+            try:
+                self._selector.unregister(connection.sock)
+            except (KeyError, ValueError):
+                pass
+        self._connections.pop(connection.sock.fileno(), None)
+        connection.sock.close()
+        self.closed += 1
+
+    def readings(self):
+        readings = Receiver.readings(self)
+        if self._paused:
+            try:
+                self._wake_writer.send(b'\0')
+            except (BlockingIOError, InterruptedError):
+                pass
+        return readings
+
+    def close(self):
+        Receiver.close(self)
+        self._listener.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+    def stats(self):
+        stats = Receiver.stats(self)
+        stats.update({'connections': len(self._connections), 'accepted': self.accepted, 'closed': self.closed,
+                      'paused': len(self._paused), 'pauses': self.pauses, 'bytes': self.bytes})
+        return stats
@@ -0,0 +1,97 @@
+import random
+import time
+
+
+class Job:
+    def __init__(self, name, period, func, jitter=0.0, retry=None, deadline=None, first_run=0.0):
+        """Job is one periodic task run by the Scheduler.  Argument descriptions: period is the
+        number of seconds between runs; func is called with no arguments and may return False to
+        ask for an early retry after retry seconds; jitter adds up to that many random seconds to
+        each run so jobs do not line up; deadline is how many seconds late a run may start before
+        the missed run is dropped and the job is rescheduled from now; first_run is the delay
+        before the first run.
+        """
+        self.name = name
+        self.period = period
+        self.func = func
+        self.jitter = jitter
+        self.retry = retry
+        self.deadline = deadline
+        self.first_run = first_run
+        self.scheduled = None
+        self.next_run = None
+        self.runs = 0
+        self.retries = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+
+    def schedule(self, when):
+        """Sets the nominal time of the next run; jitter is applied on top so it never accumulates."""
+        self.scheduled = when
+        self.next_run = when + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+
+class Scheduler:
+    def __init__(self, clock=time.time):
+        """Scheduler runs periodic jobs from the caller's thread.  The caller asks next_due for the
+        time of the next run, sleeps until then or until something else wakes it, and calls
+        run_pending.
+        """
+        self._clock = clock
+        self._jobs = []
+
+    def add(self, name, period, func, jitter=0.0, retry=None, deadline=None, first_run=0.0):
+        job = Job(name, period, func, jitter=jitter, retry=retry, deadline=deadline, first_run=first_run)
+        job.schedule(self._clock() + job.first_run)
+        self._jobs.append(job)
+        return job
+
+    def next_due(self):
+        if not self._jobs:
+            return None
+        return min(job.next_run for job in self._jobs)
+
+    def run_pending(self):
+        """Runs every job that is due and returns the names of the jobs run."""
+        ran = []
+        for job in self._jobs:
+            now = self._clock()
+            if now < job.next_run:
+                continue
+            lateness = now - job.next_run
+            if job.deadline is not None and lateness > job.deadline:
+                # Too late to be useful; drop this run rather than firing a burst of catch-up runs
+                job.missed += 1
+                job.schedule(now + job.period)
+                continue
+            job.max_lateness = max(job.max_lateness, lateness)
+            result = job.func()
+            job.runs += 1
+            ran.append(job.name)
+            if result is False and job.retry is not None:
+                job.retries += 1
+                job.schedule(self._clock() + job.retry)
+            else:
+                # Advance from the nominal time so the period does not drift with the run time
+                when = job.scheduled + job.period
+                job.schedule(when if when > self._clock() else self._clock() + job.period)
+        return ran
+
+    def set_period(self, name, period):
+        """Changes the named job's period.  Called from inside the job, it already applies to the next run."""
+        for job in self._jobs:
+            if job.name == name:
+                job.period = period
+
+    def retry(self, name):
+        """Moves the named job's next run up to its retry delay, for jobs whose failure is only known after they
+        handed their work off to another thread."""
+        for job in self._jobs:
+            if job.name == name and job.retry is not None:
+                job.retries += 1
+                job.schedule(min(job.scheduled, self._clock() + job.retry))
+
+    def stats(self):
+        return {job.name: {'period': job.period, 'next_run': job.next_run, 'runs': job.runs,
+                           'retries': job.retries, 'missed': job.missed, 'max_lateness': job.max_lateness}
+                for job in self._jobs}
@@ -1,15 +1,31 @@
-import socket
-import json
+import atexit
 import sys
 from time import sleep
 import datetime as dt
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, Column, Integer, Float, DateTime
+from sqlalchemy import (create_engine, event, inspect, text, select, union, func, cast, Column, Integer, Float,
+                        DateTime)
+from sqlalchemy.exc import SQLAlchemyError
 import threading
-import fcntl
-import os
-import errno
+import queue
+import time
+import math
+from collections import deque
+from aggregates import RollingAggregates, WINDOWS, COLUMNS
+from receiver import Reading, UdpReceiver, TcpReceiver, DEFAULT_STATION
+
+DEFAULT_DB_URL = 'sqlite:///sensor.db'
+
+# A reading older than this is too stale to show as current
+MAX_READING_AGE = dt.timedelta(minutes=5)
+
+# History stores naive local times; SQLite's strftime('%s') counts them from this epoch, and so do the aggregates
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def epoch_seconds(date_time):
+    return (date_time - EPOCH).total_seconds()
 
 
 Base = declarative_base()
@@ -17,7 +33,10 @@ Base = declarative_base()
 
 class History(Base):
     __tablename__ = 'history'
-    date_time = Column(DateTime, primary_key=True)
+    # The (station_id, date_time) key is also the index every per station lookup uses; date_time has its own for
+    # lookups across stations
+    station_id = Column(Integer, primary_key=True, default=DEFAULT_STATION)
+    date_time = Column(DateTime, primary_key=True, index=True)
     sig_strength = Column(Integer)
     temp = Column(Float)
     rain = Column(Float)
@@ -28,108 +47,573 @@ class History(Base):
     lumen = Column(Float)
 
 
+# Columns the summary tiers keep min, max, mean and count of: every History column, and the wind direction as a
+# unit vector so it can be averaged
+SUMMARY_COLUMNS = ('sig_strength', 'temp', 'rain', 'baro', 'humidity', 'wind_speed', 'wind_direction_deg', 'lumen',
+                   'wind_x', 'wind_y')
+
+
+def _summary_table(name, tablename):
+    columns = {'__tablename__': tablename, 'station_id': Column(Integer, primary_key=True),
+               'date_time': Column(DateTime, primary_key=True, index=True)}
+    for column in SUMMARY_COLUMNS:
+        columns[column + '_min'] = Column(Float)
+        columns[column + '_max'] = Column(Float)
+        columns[column + '_mean'] = Column(Float)
+        columns[column + '_count'] = Column(Integer)
+    return type(name, (Base,), columns)
+
+
+HistoryMinute = _summary_table('HistoryMinute', 'history_minute')
+HistoryHour = _summary_table('HistoryHour', 'history_hour')
+
+
+class KnownStation(Base):
+    __tablename__ = 'stations'
+    # Every station id ever stored, so listing the stations does not scan the history
+    station_id = Column(Integer, primary_key=True)
+
+
+def _raw_value(column):
+    if column in ('wind_x', 'wind_y'):
+        return getattr(func, column)(History.wind_direction_deg)
+    return getattr(History, column)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the display read while the writer appends, and with it NORMAL only syncs at checkpoints
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+    # Not every SQLite build has the math functions the wind direction summaries need
+    dbapi_connection.create_function('wind_x', 1, lambda deg: None if deg is None else math.cos(math.radians(deg)))
+    dbapi_connection.create_function('wind_y', 1, lambda deg: None if deg is None else math.sin(math.radians(deg)))
+
+
+def _add_station_key(engine):
+    """Moves a history table from before readings had a station id into the keyed layout, as station
+    DEFAULT_STATION."""
+    tables = inspect(engine).get_table_names()
+    if 'history' not in tables or 'station_id' in [c['name'] for c in inspect(engine).get_columns('history')]:
+        return
+    print("Adding station ids to the history table")
+    columns = ', '.join(c.name for c in History.__table__.columns if c.name != 'station_id')
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE history RENAME TO history_unkeyed'))
+        History.__table__.create(conn)
+        conn.execute(text('INSERT INTO history (station_id, {0}) SELECT {1}, {0} FROM history_unkeyed'.format(
+            columns, DEFAULT_STATION)))
+        conn.execute(text('DROP TABLE history_unkeyed'))
+
+
+def _fill_stations(engine):
+    """Fills a new stations table with the station ids already in the history tiers.  This scans them once, on the
+    first start after the table was added."""
+    print("Listing the stations in the history")
+    query = union(select(History.station_id), select(HistoryMinute.station_id), select(HistoryHour.station_id))
+    with engine.begin() as conn:
+        conn.execute(KnownStation.__table__.insert().from_select(['station_id'], query))
+
+
+def create_history_engine(db_url=DEFAULT_DB_URL):
+    engine = create_engine(db_url)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    _add_station_key(engine)
+    tables = inspect(engine).get_table_names()
+    Base.metadata.create_all(engine)
+    if 'history' in tables and 'stations' not in tables:
+        _fill_stations(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    return engine
+
+
+class HistoryWriter:
+    def __init__(self, engine, queue_size=1000, batch_size=50, flush_interval=5.0):
+        """HistoryWriter stores History rows from a dedicated thread so the thread receiving readings
+        never waits on the disk.  Argument descriptions: rows wait in a queue of at most queue_size
+        and are inserted in one transaction per batch, once batch_size rows are waiting or the oldest
+        has waited flush_interval seconds.  When the queue is full new rows are dropped and counted
+        rather than blocking the caller.
+        """
+        self._engine = engine
+        self._insert = History.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite')
+        self._insert_station = KnownStation.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite')
+        # Station ids known to be in the stations table; only the writer thread uses it
+        self._stations = set()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queues a row (a dict of History columns) and returns True, or returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = False
+            if row is None:
+                self._write(batch)
+                return
+            if row:
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self._flush_interval
+            if batch and (len(batch) >= self._batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+    def _write(self, batch):
+        if not batch:
+            return
+        new_stations = {row.get('station_id', DEFAULT_STATION) for row in batch} - self._stations
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(self._insert, batch)
+                if new_stations:
+                    conn.execute(self._insert_station, [{'station_id': station_id} for station_id in new_stations])
+        except SQLAlchemyError as e:
+            print("History write failed: {}".format(str(e)))
+            with self._lock:
+                self.failed += len(batch)
+            return
+        self._stations |= new_stations
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def close(self, timeout=None):
+        """Writes what is still queued and stops the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self.queued, 'dropped': self.dropped, 'written': self.written,
+                    'batches': self.batches, 'failed': self.failed, 'backlog': self._queue.qsize()}
+
+
+class Tier:
+    def __init__(self, table, resolution, parent=None):
+        """Tier is one level of history storage.  Argument descriptions: table is its ORM class;
+        resolution is the seconds each row covers, 0 for raw readings; parent is the finer tier its
+        rows are compacted from.
+        """
+        self.table = table
+        self.resolution = resolution
+        self.parent = parent
+
+    def summaries(self, bucket):
+        """Returns the (count, sum, min, max) expressions of every summary column, grouped by bucket."""
+        table = self.table
+        if self.resolution == 0:
+            return [(func.count(_raw_value(c)), func.sum(_raw_value(c)), func.min(_raw_value(c)),
+                     func.max(_raw_value(c))) for c in SUMMARY_COLUMNS]
+        return [(func.sum(getattr(table, c + '_count')),
+                 func.sum(getattr(table, c + '_mean') * getattr(table, c + '_count')),
+                 func.min(getattr(table, c + '_min')), func.max(getattr(table, c + '_max')))
+                for c in SUMMARY_COLUMNS]
+
+
+RAW = Tier(History, 0)
+MINUTE = Tier(HistoryMinute, 60, RAW)
+HOUR = Tier(HistoryHour, 3600, MINUTE)
+
+# Coarsest first
+TIERS = (HOUR, MINUTE, RAW)
+
+
+def _bucket_start(date_time, resolution):
+    return EPOCH + dt.timedelta(seconds=epoch_seconds(date_time) // resolution * resolution)
+
+
+class Compactor:
+    def __init__(self, engine, raw_days=7, minute_days=90, hour_days=None, interval=3600, batch_minutes=60):
+        """Compactor keeps History from growing without bound.  Raw readings older than raw_days are
+        rolled up into per minute summaries, and those older than minute_days into per hour summaries;
+        hourly rows older than hour_days are deleted, or kept forever when it is None.  Each tier's rows
+        move rather than copy, so any moment of history lives in exactly one tier.  The work runs on its
+        own thread every interval seconds, in transactions covering at most batch_minutes minutes of raw
+        readings (or that many hours of minute summaries) so the writer is never locked out for long.
+        """
+        self._engine = engine
+        self._ages = {MINUTE: dt.timedelta(days=raw_days), HOUR: dt.timedelta(days=minute_days)}
+        self._hour_age = None if hour_days is None else dt.timedelta(days=hour_days)
+        self._interval = interval
+        self._batch_minutes = batch_minutes
+        self._stop = threading.Event()
+        self.batches = 0
+        self.compacted = 0
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, name='history-compactor', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.compact()
+            except SQLAlchemyError as e:
+                print("History compaction failed: {}".format(str(e)))
+            self._stop.wait(self._interval)
+
+    def compact(self, now=None):
+        """Runs batches until every tier is within its age."""
+        now = now or dt.datetime.now()
+        for tier in (MINUTE, HOUR):
+            while not self._stop.is_set() and self._compact_batch(tier, now):
+                self.batches += 1
+        if self._hour_age is not None:
+            with self._engine.begin() as conn:
+                result = conn.execute(HistoryHour.__table__.delete().where(
+                    HistoryHour.date_time < now - self._hour_age))
+                self.expired += result.rowcount
+
+    def _compact_batch(self, tier, now):
+        """Moves one batch of the parent tier's rows older than the tier's age into tier.  Returns False when
+        there was nothing to move."""
+        source = tier.parent.table
+        cutoff = _bucket_start(now - self._ages[tier], tier.resolution)
+        with self._engine.begin() as conn:
+            oldest = conn.execute(select(func.min(source.date_time))).scalar()
+            if oldest is None:
+                return False
+            if isinstance(oldest, str):
+                oldest = dt.datetime.fromisoformat(oldest)
+            batch = dt.timedelta(seconds=max(tier.parent.resolution, 1) * 60 * self._batch_minutes)
+            upto = min(cutoff, _bucket_start(oldest, tier.resolution) + batch)
+            if oldest >= upto:
+                return False
+            bucket = func.strftime('%Y-%m-%d %H:%M:00.000000' if tier.resolution == 60 else
+                                   '%Y-%m-%d %H:00:00.000000', source.date_time)
+            values = []
+            for (count, total, low, high) in tier.parent.summaries(bucket):
+                values += [low, high, cast(total, Float) / func.nullif(count, 0), count]
+            names = ['station_id', 'date_time'] + [c + suffix for c in SUMMARY_COLUMNS
+                                                   for suffix in ('_min', '_max', '_mean', '_count')]
+            query = (select(source.station_id, bucket, *values).where(source.date_time < upto)
+                     .group_by(source.station_id, bucket))
+            conn.execute(tier.table.__table__.insert().prefix_with('OR REPLACE').from_select(names, query))
+            result = conn.execute(source.__table__.delete().where(source.date_time < upto))
+            self.compacted += result.rowcount
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def stats(self):
+        return {'batches': self.batches, 'compacted': self.compacted, 'expired': self.expired}
+
+
+def query_window(conn, start, end, resolution=60, station_id=None):
+    """Summarises every SUMMARY_COLUMNS column from start to end (datetimes) in buckets resolution seconds wide,
+    for one station or, when station_id is None, for all of them together.
+    Each tier is read only for the time it holds, and grouped by the database, so a coarse request over old
+    history reads the hourly rows instead of every raw reading.  Returns (bucket start in epoch seconds, counts,
+    sums, mins, maxes) for each bucket with data, oldest first; the lists follow SUMMARY_COLUMNS."""
+    buckets = {}
+    for tier in TIERS:
+        table = tier.table
+        width = max(resolution, tier.resolution, 1)
+        bucket = cast(cast(func.strftime('%s', table.date_time), Integer) / width, Integer)
+        columns = [value for summary in tier.summaries(bucket) for value in summary]
+        query = (select(bucket, *columns).where(table.date_time >= start, table.date_time < end)
+                 .group_by(bucket))
+        if station_id is not None:
+            query = query.where(table.station_id == station_id)
+        for row in conn.execute(query):
+            when = row[0] * width
+            if when in buckets:
+                merged = buckets[when]
+                for (i, offset) in enumerate(range(1, len(row), 4)):
+                    (count, total, low, high) = row[offset:offset + 4]
+                    if count:
+                        merged[0][i] += count
+                        merged[1][i] += total
+                        merged[2][i] = low if merged[2][i] is None else min(merged[2][i], low)
+                        merged[3][i] = high if merged[3][i] is None else max(merged[3][i], high)
+            else:
+                buckets[when] = ([c or 0 for c in row[1::4]], [t or 0.0 for t in row[2::4]], list(row[3::4]),
+                                 list(row[4::4]))
+    return [(when,) + buckets[when] for when in sorted(buckets)]
+
+
+def merge_readings(readings):
+    """Combines the latest readings of several stations into one: the mean of each quantity, the newest time and
+    the strongest signal.  The result has no station id."""
+    merged = Reading(date_time=max(reading.date_time for reading in readings),
+                     sig_strength=max(reading.sig_strength for reading in readings))
+    for field in ('temp', 'rain', 'baro', 'humidity', 'wind_speed', 'lumen'):
+        values = [getattr(reading, field) for reading in readings if getattr(reading, field) is not None]
+        setattr(merged, field, sum(values) / len(values) if values else None)
+    # Directions are averaged as vectors, like the aggregates do
+    directions = [math.radians(reading.wind_direction_deg) for reading in readings
+                  if reading.wind_direction_deg is not None]
+    if directions:
+        merged.wind_direction_deg = round(math.degrees(math.atan2(sum(map(math.sin, directions)),
+                                                                  sum(map(math.cos, directions)))), 1) % 360
+    return merged
+
+
+class StationTrack:
+    def __init__(self, station_id, recent_size):
+        """StationTrack is what Sensor knows about one station: its recent readings, its rolling
+        aggregates and how many readings it has sent.
+        """
+        self.station_id = station_id
+        self.recent = deque(maxlen=recent_size)
+        self.aggregates = RollingAggregates()
+        self.readings = 0
+
+    def latest(self):
+        return self.recent[-1] if self.recent else None
+
+    def stats(self):
+        latest = self.latest()
+        return {'readings': self.readings, 'last_seen': latest and latest.date_time,
+                'sig_strength': latest and latest.sig_strength}
+
+
 class Sensor:
-    def __init__(self, address=('', 10001)):
+    def __init__(self, address=('', 10001), db_url=DEFAULT_DB_URL, queue_size=1000, batch_size=50,
+                 flush_interval=5.0, recent_size=600, raw_days=7, minute_days=90, hour_days=None,
+                 compact_interval=3600, receive_queue_size=1000, rcvbuf=None, transport='udp'):
+        """Sensor receives readings from any number of weather stations and keeps them in the History
+        table, keyed by station id.  transport is 'udp' for packets read by a UdpReceiver thread, or
+        'tcp' for stations streaming over long lived connections to a TcpReceiver thread;
+        receive_queue_size, and for UDP rcvbuf, are passed on to it.  Rows are written behind by a HistoryWriter;
+        queue_size, batch_size and flush_interval are passed on to it.  The last recent_size readings
+        of each station are also kept in memory, so the newest one and its age are known without a
+        query.  A Compactor rolls old readings up into the summary tiers; raw_days, minute_days,
+        hour_days and compact_interval are passed on to it.
+        """
         self._addr = address
-        self._json = ""
-        self.data = {}
-        # self.fetch_data()
-        self._engine = create_engine('sqlite:///sensor.db')
-        Base.metadata.create_all(self._engine)
-        session = sessionmaker()
+        self._recent_size = recent_size
+        self._engine = create_history_engine(db_url)
+        session = sessionmaker(expire_on_commit=False)
         session.configure(bind=self._engine)
         self._session = session()
-        self._conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        fcntl.fcntl(self._conn, fcntl.F_SETFL, os.O_NONBLOCK)
-        self._conn.bind(self._addr)
-        # self.data = json.loads(self._json)
-
-    def fetch_data(self):
-        # conn.connect(self._addr)
-        # conn.send(b'\n')
-        # conn.settimeout(5.0)
-
-        # term = '\r\n'
-        # h_str = ''
-        # while term not in h_str:
-        #     h = conn.recv(1)
-        #     h_str += h.decode()
-        #
-        # # Ditch the deliminator
-        # h_str = h_str.replace('\r\n', '')
-        #
-        # # Find the header info
-        # sizes = h_str.split('Payload size: ')
-        #
-        # try:
-        #     size = int(sizes[1])
-        # except ValueError:
-        #     print('Invalid size value.', file=sys.stderr)
-        #     return
-
-        # j_str = ''
-        # while len(j_str) < size:
-        #     j = conn.recv(1024)
-        #     j_str += j.decode()
-        j_str = ''
-        try:
-            j_str += self._conn.recv(1024).decode()
-            # conn.close()
-        except socket.error as e:
-            # conn.close()
-            err = e.args[0]
-            if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-                pass
-            else:
-                print(e)
-                return None
-        # conn.close()
-        self._json = j_str
-        if self._json:
-            try:
-                self.data = json.loads(self._json)
-            except TypeError or ValueError:
-                return None
+        self._writer = HistoryWriter(self._engine, queue_size=queue_size, batch_size=batch_size,
+                                     flush_interval=flush_interval)
+        self._stations = {}
+        self._loaded_latest = False
+        self.aggregates = RollingAggregates()
+        self.rebuild_aggregates()
+        self._compactor = Compactor(self._engine, raw_days=raw_days, minute_days=minute_days, hour_days=hour_days,
+                                    interval=compact_interval)
+        self._compactor.start()
+        if transport == 'tcp':
+            self._receiver = TcpReceiver(address, queue_size=receive_queue_size)
+        elif transport == 'udp':
+            self._receiver = UdpReceiver(address, queue_size=receive_queue_size, rcvbuf=rcvbuf)
         else:
-            return None
+            raise ValueError('Unknown transport: {}'.format(transport))
+        self._receiver.start()
+        # The writer and the receiver run on daemon threads, so flush what they hold when the process exits
+        self._closed = False
+        atexit.register(self.close)
 
-        return j_str
+    def _station(self, station_id):
+        track = self._stations.get(station_id)
+        if track is None:
+            track = self._stations[station_id] = StationTrack(station_id, self._recent_size)
+        return track
 
     def update_history(self):
-        if self.fetch_data():
-            print(self.data)
-            hist = History(date_time=dt.datetime.now(), sig_strength=self.data['RSSI'], temp=self.data['Temperature'],
-                           rain=self.data['Rain'], baro=self.data['Pressure'], humidity=self.data['Humidity'],
-                           wind_speed=self.data['Wind Speed'], wind_direction_deg=self.data['Direction'],
-                           lumen=self.data['Lumens'])
-            self._session.add(hist)
-            self._session.commit()
-
-    def get_current(self):
+        """Takes every reading received since the last call and ingests it: the newest readings are kept in
+        memory, the aggregates are updated and the rows are queued for the writer.  Returns the number ingested."""
+        readings = self._receiver.readings()
+        for reading in readings:
+            row = reading.as_row()
+            when = epoch_seconds(reading.date_time)
+            track = self._station(reading.station_id)
+            track.recent.append(reading)
+            track.readings += 1
+            track.aggregates.add(when, **row)
+            self.aggregates.add(when, **row)
+            self._writer.submit(row)
+        return len(readings)
+
+    def _load_latest(self):
+        """On a cold start, fills each station's buffer with its newest stored row, found through the key index."""
+        self._loaded_latest = True
+        stations = [station_id for (station_id,) in self._session.query(KnownStation.station_id)]
+        for station_id in stations:
+            row = (self._session.query(History).filter(History.station_id == station_id)
+                   .order_by(History.date_time.desc()).limit(1).first())
+            track = self._station(station_id)
+            if row is not None and not track.recent:
+                track.recent.append(Reading.from_history(row))
+        self._session.commit()
+
+    def stations(self):
+        """Returns the ids of every station heard from."""
+        if not self._loaded_latest:
+            self._load_latest()
+        return sorted(self._stations)
+
+    def latest(self, station_id=None):
+        """Returns the newest Reading of a station, or when station_id is None the merge of every station's newest
+        reading that is not stale.  Returns None if there is none.  Only on a cold start, before anything has been
+        received, is the database asked for the newest rows."""
+        if not self._loaded_latest and not any(track.recent for track in self._stations.values()):
+            self._load_latest()
+        if station_id is not None:
+            track = self._stations.get(station_id)
+            return track and track.latest()
+        latest = [track.latest() for track in self._stations.values() if track.recent]
+        if not latest:
+            return None
+        if len(latest) == 1:
+            return latest[0]
+        newest = max(reading.date_time for reading in latest)
+        fresh = [reading for reading in latest if newest - reading.date_time <= MAX_READING_AGE]
+        return merge_readings(fresh) if len(fresh) > 1 else fresh[0]
+
+    def age(self, station_id=None):
+        """Returns the age of the newest reading as a timedelta, or None if there is none."""
+        latest = self.latest(station_id)
+        if latest is None:
+            return None
+        return dt.datetime.now() - latest.date_time
+
+    def is_stale(self, max_age=MAX_READING_AGE, station_id=None):
+        age = self.age(station_id)
+        return age is None or age > max_age
+
+    def recent(self, station_id=DEFAULT_STATION):
+        """Returns a station's readings held in memory, oldest first."""
+        track = self._stations.get(station_id)
+        return list(track.recent) if track else []
+
+    def window(self, start, end, resolution=60, station_id=None):
+        """Returns the history from start to end in buckets resolution seconds wide; see query_window."""
+        with self._engine.connect() as conn:
+            return query_window(conn, start, end, resolution, station_id)
+
+    def rebuild_aggregates(self):
+        """Refills the aggregates from the history tiers.  Each window is read over its own span in buckets of its
+        own width, so even a year of history is a few hundred rows per station, and the aggregates for all stations
+        together are filled from the same rows."""
+        now = dt.datetime.now()
+        now_seconds = int(epoch_seconds(now))
+        picks = [SUMMARY_COLUMNS.index(column) for column in COLUMNS]
+        aggregates = RollingAggregates()
+        rebuilt = {}
+        try:
+            with self._engine.connect() as conn:
+                stations = [station_id for (station_id,) in conn.execute(select(KnownStation.station_id))]
+                for station_id in stations:
+                    station_aggregates = rebuilt[station_id] = RollingAggregates()
+                    for (name, (span, width)) in WINDOWS.items():
+                        # Start of the oldest bucket the window still holds
+                        start = EPOCH + dt.timedelta(seconds=(now_seconds // width - span // width + 1) * width)
+                        for (when, counts, totals, lows, highs) in query_window(conn, start, now, width, station_id):
+                            summary = ([counts[i] for i in picks], [totals[i] for i in picks],
+                                       [lows[i] for i in picks], [highs[i] for i in picks])
+                            station_aggregates.merge_window(name, when, *summary)
+                            aggregates.merge_window(name, when, *summary)
+        except SQLAlchemyError as e:
+            print("Could not rebuild history aggregates: {}".format(str(e)))
+            return
+        for (station_id, station_aggregates) in rebuilt.items():
+            self._station(station_id).aggregates = station_aggregates
+        self.aggregates = aggregates
+
+    def history(self, stat='mean', station_id=None):
+        """Returns an Observation summarising each history window, for one station or for all of them."""
+        aggregates = self.aggregates
+        if station_id is not None:
+            track = self._stations.get(station_id)
+            if track is None:
+                return RollingAggregates().history(epoch_seconds(dt.datetime.now()), stat)
+            aggregates = track.aggregates
+        return aggregates.history(epoch_seconds(dt.datetime.now()), stat)
+
+    def get_current(self, station_id=None):
         self.update_history()
-        ct = dt.datetime.now()
-        recent = ct - dt.timedelta(minutes=5)
-        result = self._session.query(History).filter(History.date_time > recent).all()
-        if result:
-            return result[-1]
-        else:
+        if self.is_stale(station_id=station_id):
             return None
+        return self.latest(station_id)
+
+    def station_stats(self):
+        """Returns each station's reading count, last reading time, signal strength and packets lost in transit."""
+        lost = dict(self._receiver.lost_by_station)
+        stats = {}
+        for (station_id, track) in list(self._stations.items()):
+            stats[station_id] = track.stats()
+            stats[station_id]['lost'] = lost.get(station_id, 0)
+            stats[station_id]['address'] = self._receiver.addresses.get(station_id)
+        return stats
+
+    def writer_stats(self):
+        return self._writer.stats()
+
+    def receiver_stats(self):
+        return self._receiver.stats()
+
+    def compactor_stats(self):
+        return self._compactor.stats()
+
+    def close(self):
+        """Stops receiving, ingests the readings still queued and writes every row before returning.  Safe to
+        call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._receiver.close()
+        self.update_history()
+        self._compactor.stop()
+        self._writer.close()
 
 
 if __name__ == '__main__':
     s = Sensor(address=('192.168.0.255', 7001))
     t1 = threading.Thread(target=s.update_history)
     t1.run()
-    while True:
-        try:
-            # s.update_history()
-            report = s.get_current()
-            print((report.date_time.strftime("%D %T"), report.sig_strength, report.temp, report.rain, report.baro,
-                   report.humidity, report.wind_speed, report.wind_direction_deg, report.lumen))
-            # time.sleep(1)
-        except InterruptedError:
-            break
-    t1.join()
+    try:
+        while True:
+            try:
+                # s.update_history()
+                report = s.get_current()
+                print((report.date_time.strftime("%D %T"), report.sig_strength, report.temp, report.rain, report.baro,
+                       report.humidity, report.wind_speed, report.wind_direction_deg, report.lumen))
+                # time.sleep(1)
+            except InterruptedError:
+                break
+        t1.join()
+    finally:
+        s.close()
 
 
 
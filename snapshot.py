@@ -0,0 +1,31 @@
+import threading
+
+
+class Publisher:
+    def __init__(self, initial):
+        """Publisher holds the latest snapshot a producer has published, together with a version that
+        goes up by one on every publish.  Producers build a complete, immutable snapshot and publish it
+        in one reference swap, so readers always see a whole snapshot without taking a lock; comparing
+        versions tells them whether anything changed since they last looked.
+        """
+        self._published = (0, initial)
+        self._publish_lock = threading.Lock()
+
+    def publish(self, snapshot):
+        """Makes snapshot the current one and returns its version.  Only producers contend for the lock."""
+        with self._publish_lock:
+            version = self._published[0] + 1
+            self._published = (version, snapshot)
+        return version
+
+    def snapshot(self):
+        """Returns (version, snapshot) for the current snapshot, read together."""
+        return self._published
+
+    @property
+    def version(self):
+        return self._published[0]
+
+    @property
+    def current(self):
+        return self._published[1]
@@ -1,17 +1,66 @@
 from weather import WeatherStationWU, WeatherForecasts, IndoorSensor, WeatherStationSensor
 from sensor import Sensor
 import settings
+import threading
 import time
 
+DEFAULT_LOCATIONS = (('MD', 'Odenton'),)
+
+# Weather objects are shared by every SystemData in the process, one per distinct query, so displays
+# showing the same location never fetch it twice.
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _shared_instance(key, factory):
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
 
 class SystemData:
 
-    def __init__(self):
+    def __init__(self, forecast_days=5, locations=DEFAULT_LOCATIONS):
+        """SystemData holds the weather for one or more (state, city) locations.  ws and forecasts
+        are the selected location's station and forecasts; select and rotate change the selection
+        without fetching anything.
+        """
         # sensor = Sensor(address=('', 7001))
         # self.ws = WeatherStationSensor(sensor)
-        self.ws = WeatherStationWU()
-        self.forecasts = WeatherForecasts()
+        self.locations = [tuple(location) for location in locations]
+        self.stations = {location: _shared_instance(('conditions',) + location,
+                                                    lambda: WeatherStationWU(*location))
+                         for location in self.locations}
+        self.forecast_sets = {location: _shared_instance(('forecast', forecast_days) + location,
+                                                         lambda: WeatherForecasts(forecast_days, *location))
+                              for location in self.locations}
+        self.forecast_dates = {location: None for location in self.locations}
         self.weather_icons = settings.wu_forecasts
         self.wind_dirs = settings.wu_wind_dirs
-        self.current_date = None
-        self.indoor = IndoorSensor()
+        self.indoor = _shared_instance(('indoor',), IndoorSensor)
+        self.selected = 0
+
+    @property
+    def location(self):
+        return self.locations[self.selected]
+
+    @property
+    def ws(self):
+        return self.stations[self.location]
+
+    @property
+    def forecasts(self):
+        return self.forecast_sets[self.location]
+
+    def select(self, location):
+        """Selects a location by index or by (state, city)."""
+        self.selected = location if isinstance(location, int) else self.locations.index(tuple(location))
+
+    def rotate(self, step=1):
+        self.selected = (self.selected + step) % len(self.locations)
+
+    def forecasts_due(self):
+        """Returns the locations whose forecast has not been fetched today."""
+        today = time.strftime("%d/%m")
+        return [location for location in self.locations if self.forecast_dates[location] != today]
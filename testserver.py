@@ -1,21 +1,97 @@
+import argparse
+import json
+import math
+import random
 import socket
+import time
+from receiver import encode_binary
 
 
-def test_server():
-    str = "{\"Temperature\": 80.5, \"Humidity\": 34.0, \"Pressure\": 23.0, \"Altitude\": 0.5, " \
-          "\"Lumens\": 8.5, \"Wind Speed\": 34.5, \"Direction\": 20, \"Rain\": 4, \"RSSI\": -23}"
-    conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    conn.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    conn.bind(('localhost', 10001))
-    conn.listen(10)
+def reading(station_id, sequence):
+    """Returns a plausible reading, as a mapping of JSON keys to values, that drifts slowly with sequence."""
+    phase = sequence / 600.0 + station_id
+    return {'Station': station_id, 'Temperature': round(70 + 10 * math.sin(phase) + random.uniform(-0.5, 0.5), 1),
+            'Humidity': round(50 + 20 * math.cos(phase), 1), 'Pressure': round(29.9 + 0.2 * math.sin(phase / 3), 2),
+            'Altitude': 0.5, 'Lumens': round(max(0.0, 800 * math.sin(phase)), 1),
+            'Wind Speed': round(abs(8 * math.sin(phase * 2)) + random.uniform(0, 3), 1),
+            'Direction': int(sequence + 90 * station_id) % 360, 'Rain': round(max(0.0, math.sin(phase / 5)), 2),
+            'RSSI': random.randint(-90, -30)}
 
-    while True:
-        try:
-            (clientsocket, address) = conn.accept()
-            clientsocket.send(bytes(str, encoding='ascii'))
-        except KeyboardInterrupt:
+
+def frame(values, station_id, sequence, packet_format, framing):
+    """Returns one reading encoded as packet_format ('json' or 'binary') and framed for the stream."""
+    if packet_format == 'binary':
+        packet = encode_binary(values, station_id, sequence)
+    else:
+        packet = bytes(json.dumps(values), encoding='ascii')
+    if framing == 'line':
+        return packet + b'\n'
+    if framing == 'length':
+        return len(packet).to_bytes(4, 'big') + packet
+    return packet
+
+
+def connect(transport, address):
+    if transport == 'udp':
+        conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        conn.connect(address)
+        return conn
+    return socket.create_connection(address)
+
+
+def test_server(host='localhost', port=10001, rate=1.0, stations=1, transport='tcp', packet_format='json',
+                framing='line', count=None):
+    """Streams readings from stations to a Sensor at rate readings a second per station, standing in for the
+    weather stations.  Over TCP one long lived connection is kept per station, and count, if given, stops
+    after that many readings each."""
+    address = (host, port)
+    conns = [connect(transport, address) for _ in range(stations)]
+    if transport == 'udp':
+        framing = None
+    elif packet_format == 'binary':
+        # Binary packets can contain newlines
+        framing = 'length'
+    interval = 1.0 / rate
+    sequence = 0
+    sent = 0
+    started = time.monotonic()
+    try:
+        while count is None or sequence < count:
+            for (station_id, conn) in enumerate(conns):
+                conn.sendall(frame(reading(station_id, sequence), station_id, sequence, packet_format, framing))
+                sent += 1
+            sequence += 1
+            # Sleep to the next tick on the schedule, so a slow send does not lower the rate
+            delay = started + sequence * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("Send failed: {}".format(str(e)))
+    finally:
+        for conn in conns:
             conn.close()
-            break
+    elapsed = time.monotonic() - started
+    print('Sent {} readings in {:.1f}s ({:.1f}/s)'.format(sent, elapsed, sent / elapsed if elapsed else 0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream sensor readings to a Sensor, standing in for the '
+                                                 'weather stations.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=10001)
+    parser.add_argument('--rate', type=float, default=1.0, help='readings a second from each station')
+    parser.add_argument('--stations', type=int, default=1)
+    parser.add_argument('--count', type=int, default=None, help='readings from each station before stopping')
+    parser.add_argument('--transport', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--format', dest='packet_format', choices=('json', 'binary'), default='json')
+    parser.add_argument('--framing', choices=('line', 'length'), default='line',
+                        help='TCP framing; binary packets are always length prefixed')
+    args = parser.parse_args()
+    test_server(args.host, args.port, args.rate, args.stations, args.transport, args.packet_format, args.framing,
+                args.count)
+
 
 if __name__ == '__main__':
-    test_server()
+    main()
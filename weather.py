@@ -1,10 +1,18 @@
 import json
-import requests
 from settings import api_key
 from sensor import Sensor
 import time
+import threading
 import htu
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
+from http_client import shared_client, DEFAULT_TIMEOUT
+from api_cache import shared_cache, shared_budget, BudgetExceededError
+from observation import Observation, EMPTY, to_float
+from snapshot import Publisher
+from aggregates import RollingAggregates
+from types import MappingProxyType
+
+HISTORY_WINDOWS = ('hour', 'day', 'week', 'month', 'year')
 
 
 def mean(numbers):
@@ -24,258 +32,367 @@ def convert_sig(rssi):
         return 0
 
 
-class IndoorSensor:
+def wind_power(speed):
+    """Returns the wind power class for a speed in mph, which picks the weather vane icon."""
+    if speed is None or speed < 11.0:
+        return 'calm'
+    elif speed < 28.0:
+        return 'mild'
+    elif speed < 49.0:
+        return 'heavy'
+    else:
+        return 'severe'
+
+
+class StationState:
+    __slots__ = ('observation', 'history', 'wind_direction', 'wind_power', 'sig_strength')
+
+    def __init__(self, observation=EMPTY, history=None, wind_direction='unknown', wind_power='calm', sig_strength=0):
+        """StationState is the immutable snapshot a station publishes.  Argument descriptions:
+        observation is the current Observation; history maps each of HISTORY_WINDOWS to the
+        Observation summarising it; wind_direction and wind_power pick the weather vane icon;
+        sig_strength is the signal strength from 0 to 4.
+        """
+        set_field = object.__setattr__
+        set_field(self, 'observation', observation)
+        set_field(self, 'history', MappingProxyType(dict(history or {window: EMPTY for window in HISTORY_WINDOWS})))
+        set_field(self, 'wind_direction', wind_direction)
+        set_field(self, 'wind_power', wind_power)
+        set_field(self, 'sig_strength', sig_strength)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('StationState is immutable')
+
+    def replace(self, **values):
+        """Returns a copy with the given fields changed."""
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields.update(values)
+        return StationState(**fields)
+
+
+class Station(Publisher):
+    """Read only views of the latest published StationState.  Readers that use several of these together should
+    take snapshot() once instead, so every value comes from the same state."""
+
+    @property
+    def observation(self):
+        return self.current.observation
+
+    @property
+    def history(self):
+        return self.current.history
+
+    @property
+    def wind_direction(self):
+        return self.current.wind_direction
+
+    @property
+    def wind_power(self):
+        return self.current.wind_power
+
+    @property
+    def sig_strength(self):
+        return self.current.sig_strength
+
+
+class IndoorSensor(Publisher):
     def __init__(self):
+        """IndoorSensor publishes each reading of the indoor sensor as an Observation."""
+        Publisher.__init__(self, EMPTY)
         self.indoor_sensor = htu.HTU21D()
-        self.temp_f = '0'
-        self.temp_c = '0'
-        self.temp_c_raw = 0
-        self.humidity = '0'
+
+    @property
+    def observation(self):
+        return self.current
+
+    @property
+    def temp_c(self):
+        temp = self.current.temp
+        return None if temp is None else (temp - 32) / 1.8
+
+    def read_indoor(self):
+        """Reads the sensor without touching the stored values; returns (temp_c, humidity)."""
+        return self.indoor_sensor.read_temperature(), self.indoor_sensor.read_humidity()
+
+    def apply_indoor(self, reading):
+        (temp_c, humidity) = reading
+        self.publish(Observation.now(temp=temp_c * 1.8 + 32, humidity=humidity))
 
     def update_indoor(self):
-        self.temp_c_raw = self.indoor_sensor.read_temperature()
-        self.temp_c = "{:10.1f}".format(self.temp_c_raw)
-        self.temp_f = "{:10.1f}".format(self.temp_c_raw * 1.8 + 32)
-        self.humidity = "{:10.1f}".format(self.indoor_sensor.read_humidity())
+        self.apply_indoor(self.read_indoor())
 
 
-class WeatherStationWU:
-    def __init__(self, state='MD', city='Odenton'):
+class WeatherStationWU(Station):
+    def __init__(self, state='MD', city='Odenton', timeout=DEFAULT_TIMEOUT, client=None, cache=None, budget=None):
+        Publisher.__init__(self, StationState(sig_strength=2))
         self._state = state
         self._city = city
-        self._current_json = None
+        self._timeout = timeout
+        self._client = client or shared_client()
+        self._cache = cache or shared_cache()
+        self._budget = budget or shared_budget()
+        self._fetch_lock = threading.Lock()
         self._wind_speeds = []
-        self.sig_strength = 2
         self._wind_directions = ['n', 's', 'e', 'w', 'ne', 'se', 'nw', 'sw']
-        self.temp = {'current': '0', 'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.rain = {'current': '0', 'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.baro = {'current': '0', 'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.humidity = {'current': '0', 'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.wind_speed = {'current': '0', 'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.wind_direction_deg = {'current': '0',  'hour': '0', 'day': '0', 'week': '0', 'month': '0', 'year': '0'}
-        self.wind_direction = 'unknown'
-        self.wind_gust = '0'
-        self.wind_power = 'calm'
-        self.wind_avg = '0'
-        self.lumen = '0'
-        self.heat_index = '0'
-        self.wind_chill = '0'
+        self._aggregates = RollingAggregates()
 
     def get_wind_direction(self):
         pass
 
-    def wind_factor(self):
-        if float(self.wind_speed['current']) < 11.0:
-            self.wind_power = 'calm'
-        elif float(self.wind_speed['current']) < 28.0:
-            self.wind_power = 'mild'
-        elif float(self.wind_speed['current']) < 49.0:
-            self.wind_power = 'heavy'
-        else:
-            self.wind_power = 'severe'
-
-    def update_station(self, daily_flush=False):
-        if daily_flush:
-            self._wind_speeds = []
-
+    def fetch_station(self):
+        """Requests the current conditions and returns the decoded response without touching the stored values.
+        This is the only part of an update that blocks, so it can run on a worker thread.  A response still fresh
+        in the cache is returned without a request, and a request the budget cannot afford is not made.  Callers
+        sharing this station wait for a fetch already in progress and then get its cached response."""
+        with self._fetch_lock:
+            return self._fetch_station()
+
+    def _fetch_station(self):
+        key = 'conditions_{}_{}'.format(self._state, self._city)
+        cached = self._cache.get('conditions', key)
+        if cached is not None:
+            return cached
         try:
-            r = requests.post(
+            r = self._client.post(
                 'http://api.wunderground.com/api/{}/'
-                'conditions/q/{}/{}.json'.format(api_key, self._state, self._city))
-            self._current_json = json.loads(r.content.decode())
+                'conditions/q/{}/{}.json'.format(api_key, self._state, self._city), timeout=self._timeout,
+                acquire=lambda: self._budget.acquire('conditions'))
+            current_json = json.loads(r.content.decode())
+            if 'current_observation' in current_json:
+                self._cache.put(key, current_json)
+            return current_json
 
         except ValueError as e:
             print("Malformed or Empty Response")
-            return
+            return None
 
-        except ConnectionError as e:
+        except BudgetExceededError:
+            raise
+
+        except (ConnectionError, Timeout) as e:
             print("Connection Failed - {}".format(str(e)))
             raise ConnectionError
 
+    def apply_station(self, current_json, daily_flush=False):
+        if daily_flush:
+            self._wind_speeds = []
+
+        if current_json is None:
+            return
+
         try:
-            self._current_json['current_observation']
-        except KeyError:
+            current = current_json['current_observation']
+        except (KeyError, TypeError):
             print("Update Failed")
             return
 
-        print(self._current_json)
-
-        try:
-            self._wind_speeds.append(float(self._current_json['current_observation']['wind_mph']))
-        except ValueError:
-            # TODO: add a method for writing errors to a logfile.
-            pass
+        observed = to_float(current.get('observation_epoch')) or time.time()
+        # A response served again from the cache is the same observation, and must not be counted twice
+        new = observed != self.current.observation.time
+        wind_speed = to_float(current.get('wind_mph'))
+        wind_speeds = self._wind_speeds
+        if new and wind_speed is not None:
+            wind_speeds = wind_speeds + [wind_speed]
         try:
-            self.wind_avg = "{0:.1f}".format(mean(self._wind_speeds))
-            self.temp['current'] = str(self._current_json['current_observation']['temp_f'])
-            self.rain['current'] = str(self._current_json['current_observation']['precip_today_in'])
-            self.baro['current'] = str(self._current_json['current_observation']['pressure_in'])
-            self.humidity['current'] = str(self._current_json['current_observation']['relative_humidity'])
-            self.wind_speed['current'] = "%d" % self._current_json['current_observation']['wind_mph']
-            self.wind_direction_deg['current'] = str(self._current_json['current_observation']['wind_degrees'])
-            self.wind_direction = str(self._current_json['current_observation']['wind_dir'])
-            self.heat_index = str(self._current_json['current_observation']['heat_index_f'])
-            self.wind_chill = str(self._current_json['current_observation']['windchill_f'])
-            self.wind_gust = str(self._current_json['current_observation']['wind_gust_mph'])
-        except TypeError:
+            observation = Observation(
+                time=observed,
+                temp=to_float(current['temp_f']),
+                rain=to_float(current['precip_today_in']),
+                baro=to_float(current['pressure_in']),
+                humidity=to_float(current['relative_humidity']),
+                wind_speed=wind_speed,
+                wind_direction_deg=to_float(current['wind_degrees']),
+                heat_index=to_float(current['heat_index_f']),
+                wind_chill=to_float(current['windchill_f']),
+                wind_gust=to_float(current['wind_gust_mph']),
+                wind_avg=mean(wind_speeds) if wind_speeds else None)
+            wind_direction = str(current['wind_dir'])
+        except KeyError:
             print("No Update Made")
-        try:
-            self.wind_factor()
-        except ValueError:
-            print("Something isn't right.")
-            # Todo: write to logfile.
+            return
+        self._wind_speeds = wind_speeds
+        if new:
+            self._aggregates.add(observation.time, **{field: getattr(observation, field)
+                                                      for field in Observation.fields})
+        self.publish(self.current.replace(observation=observation, history=self._aggregates.history(),
+                                          wind_direction=wind_direction, wind_power=wind_power(wind_speed)))
 
+    def update_station(self, daily_flush=False):
+        self.apply_station(self.fetch_station(), daily_flush)
 
-class WeatherStationSensor:
-    def __init__(self, sensor):
+
+class WeatherStationSensor(Station):
+    def __init__(self, sensor, station_id=None):
+        """WeatherStationSensor publishes the readings a Sensor receives.  station_id picks one station;
+        None merges every station the sensor hears.
+        """
+        Publisher.__init__(self, StationState(wind_direction='UKN', wind_power='--'))
         self._sensor = sensor
-        self._current_json = None
+        self.station_id = station_id
         self._wind_speeds = []
-        self.sig_strength = 0
         self._wind_directions = ['n', 's', 'e', 'w', 'ne', 'se', 'nw', 'sw']
-        self.temp = {'current': '-', 'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.rain = {'current': '-', 'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.baro = {'current': '-', 'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.humidity = {'current': '-', 'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.wind_speed = {'current': '-', 'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.wind_direction_deg = {'current': '-',  'hour': '-', 'day': '-', 'week': '-', 'month': '-', 'year': '-'}
-        self.wind_direction = 'UKN'
-        self.wind_gust = '-'
-        self.wind_power = '--'
-        self.wind_avg = '-'
-        self.lumen = '-'
-        self.heat_index = '-'
-        self.wind_chill = '-'
-
-    def _update_wind_direction(self):
-        wind_dirs = {'0.0': 'n', '180.0': 's', '90.0': 'e', '270.0': 'w', '45.0': 'ne', '135.0': 'se', '225.0': 'sw',
-                     '315.0': 'nw', '23.0': 'ne', '68.0': 'ne', '113.0': 'se', '158.0': 'se', '203.0': 'sw',
-                     '248.0': 'sw', '293.0': 'nw', '338.0': 'nw'}
-        if str(self.wind_direction_deg['current']) in wind_dirs:
-            self.wind_direction = wind_dirs[str(self.wind_direction_deg['current'])]
-
-    def _update_wind_factor(self):
-        if float(self.wind_speed['current']) < 11.0:
-            self.wind_power = 'calm'
-        elif float(self.wind_speed['current']) < 28.0:
-            self.wind_power = 'mild'
-        elif float(self.wind_speed['current']) < 49.0:
-            self.wind_power = 'heavy'
-        else:
-            self.wind_power = 'severe'
 
-    def update_station(self, verbose=False):
-        self._sensor.update_history()
-        data = self._sensor.get_current()
+    def _wind_direction(self, degrees):
+        wind_dirs = {0.0: 'n', 180.0: 's', 90.0: 'e', 270.0: 'w', 45.0: 'ne', 135.0: 'se', 225.0: 'sw',
+                     315.0: 'nw', 23.0: 'ne', 68.0: 'ne', 113.0: 'se', 158.0: 'se', 203.0: 'sw',
+                     248.0: 'sw', 293.0: 'nw', 338.0: 'nw'}
+        return wind_dirs.get(degrees, self.current.wind_direction)
+
+    def select(self, station_id=None):
+        """Shows one station from now on, or all of them merged when station_id is None."""
+        self.station_id = station_id
+
+    def stations(self):
+        return self._sensor.stations()
+
+    def fetch_station(self):
+        """Reads pending packets and returns the newest reading without touching the station values."""
+        return self._sensor.get_current(self.station_id)
+
+    def apply_station(self, data, verbose=False):
         if data:
-            self.sig_strength = convert_sig(data.sig_strength)
-            self.temp['current'] = str(data.temp)
-            self.rain['current'] = str(data.rain)
-            self.baro['current'] = str(data.baro)
-            self.humidity['current'] = str(data.humidity)
-            self.wind_speed['current'] = str(data.wind_speed)
-            self.wind_direction_deg['current'] = str(data.wind_direction_deg)
-            self.lumen = str(data.lumen)
-            self._update_wind_direction()
-            self._update_wind_factor()
+            observation = Observation(time=data.date_time.timestamp(), temp=to_float(data.temp),
+                                      rain=to_float(data.rain), baro=to_float(data.baro),
+                                      humidity=to_float(data.humidity), wind_speed=to_float(data.wind_speed),
+                                      wind_direction_deg=to_float(data.wind_direction_deg),
+                                      lumen=to_float(data.lumen))
+            self.publish(self.current.replace(observation=observation,
+                                              history=self._sensor.history(station_id=self.station_id),
+                                              sig_strength=convert_sig(data.sig_strength),
+                                              wind_direction=self._wind_direction(observation.wind_direction_deg),
+                                              wind_power=wind_power(observation.wind_speed)))
 
         if verbose:
             if data:
-                print((self.sig_strength, self.temp['current'], self.rain['current'], self.baro['current'],
-                       self.humidity['current'], self.wind_speed['current'], self.wind_direction_deg['current'],
-                       self.wind_direction, self.wind_power, self.lumen))
+                state = self.current
+                print((state.sig_strength, state.observation, state.wind_direction, state.wind_power))
+
+    def update_station(self, verbose=False):
+        self.apply_station(self.fetch_station(), verbose)
 
 
 class DayForecast:
+    __slots__ = ('day', 'low_temp', 'high_temp', 'feels_like', 'wind_speed', 'baro', 'wind_dir', 'humid', 'vis',
+                 'gust', 'wind_direction', 'rain', 'icon')
+
+    # Fields stored with a degree sign appended
+    _degree_fields = ('low_temp', 'high_temp', 'feels_like')
+
     def __init__(self):
-        self.day = '-'
-        self.low_temp = '-'
-        self.high_temp = '-'
-        self.feels_like = '-'
-        self.wind_speed = '-'
-        self.baro = '-'
-        self.wind_dir = '-'
-        self.humid = '-'
-        self.vis = '-'
-        self.gust = '-'
-        self.wind_direction = '-'
-        self.rain = '-'
+        for field in self.__slots__:
+            setattr(self, field, '-')
         self.icon = 29
 
     def update_day(self, **kwargs):
-        if 'day' in kwargs:
-            self.day = kwargs['day']
-        if 'low_temp' in kwargs:
-            self.low_temp = kwargs['low_temp'] + chr(0x00B0)
-        if 'high_temp' in kwargs:
-            self.high_temp = kwargs['high_temp'] + chr(0x00B0)
-        if 'feels_like' in kwargs:
-            self.feels_like = kwargs['feels_like'] + chr(0x00B0)
-        if 'wind_speed' in kwargs:
-            self.wind_speed = kwargs['wind_speed']
-        if 'baro' in kwargs:
-            self.baro = kwargs['bara']
-        if 'wind_dir' in kwargs:
-            self.wind_dir = kwargs['wind_dir']
-        if 'humid' in kwargs:
-            self.humid = kwargs['humid']
-        if 'vis' in kwargs:
-            self.vis = kwargs['vis']
-        if 'gust' in kwargs:
-            self.gust = kwargs['gust']
-        if 'wind_direction' in kwargs:
-            self.wind_direction = kwargs['wind_direction']
-        if 'rain' in kwargs:
-            self.rain = kwargs['rain']
-        if 'icon' in kwargs:
-            self.icon = kwargs['icon']
-
-
-class WeatherForecasts:
-    def __init__(self, days=5, state='MD', city='Odenton'):
+        for (field, value) in kwargs.items():
+            if field in self._degree_fields:
+                value += chr(0x00B0)
+            if field in self.__slots__:
+                setattr(self, field, value)
+
+    def to_row(self):
+        return [self.day, self.high_temp, self.low_temp, self.rain, self.icon]
+
+    @classmethod
+    def from_row(cls, row):
+        forecast = cls()
+        (forecast.day, forecast.high_temp, forecast.low_temp, forecast.rain, forecast.icon) = row
+        return forecast
+
+
+def parse_forecasts(json_forecasts, days):
+    """Pulls the fields the display uses out of a forecast10day response in one pass and returns a list of
+    DayForecast, or None if the response has no forecast.  Nothing else from the response is kept."""
+    try:
+        forecast_days = json_forecasts['forecast']['simpleforecast']['forecastday']
+    except (KeyError, TypeError):
+        print("Empty Forecast Set or Malformed Data")
+        return None
+
+    degree = chr(0x00B0)
+    forecasts = []
+    try:
+        for day in forecast_days[:days]:
+            forecast = DayForecast()
+            forecast.day = day['date']['weekday']
+            forecast.low_temp = day['low']['fahrenheit'] + degree
+            forecast.high_temp = day['high']['fahrenheit'] + degree
+            forecast.rain = str(day['pop'])
+            forecast.icon = day['icon']
+            forecasts.append(forecast)
+    except (KeyError, TypeError):
+        print("Empty Forecast Set or Malformed Data")
+        return None
+    forecasts += [DayForecast() for _ in range(days - len(forecasts))]
+    return forecasts
+
+
+class WeatherForecasts(Publisher):
+    def __init__(self, days=5, state='MD', city='Odenton', timeout=DEFAULT_TIMEOUT, client=None, cache=None,
+                 budget=None):
+        """WeatherForecasts publishes the forecast for days days as a tuple of DayForecast."""
+        Publisher.__init__(self, tuple(DayForecast() for _ in range(days)))
         self._days = days
         self._state = state
         self._city = city
-        self._json_forecasts = None
-        self.forecasts = [DayForecast() for _ in range(days)]
-
-    def update_forecast_data(self):
-
+        self._timeout = timeout
+        self._client = client or shared_client()
+        self._cache = cache or shared_cache()
+        self._budget = budget or shared_budget()
+        self._fetch_lock = threading.Lock()
+
+    @property
+    def forecasts(self):
+        return self.current
+
+    def fetch_forecast_data(self):
+        """Requests the forecast and returns it parsed into a list of DayForecast, or None, without touching the
+        stored forecasts.  The raw response is dropped as soon as it is parsed; only the parsed days are cached, and
+        they are only reused on the day they were fetched, since day one moves at midnight."""
+        with self._fetch_lock:
+            return self._fetch_forecast_data()
+
+    def _fetch_forecast_data(self):
+        key = 'forecast10day_{}_{}_{}'.format(self._state, self._city, self._days)
+        cached = self._cache.get('forecast10day', key, same_day=True)
+        if cached is not None:
+            return [DayForecast.from_row(row) for row in cached]
         try:
-            r = requests.post(
+            r = self._client.post(
                 'http://api.wunderground.com/api/{}/'
-                'forecast10day/q/{}/{}.json'.format(api_key, self._state, self._city))
-        except ConnectionError:
+                'forecast10day/q/{}/{}.json'.format(api_key, self._state, self._city), timeout=self._timeout,
+                acquire=lambda: self._budget.acquire('forecast10day'))
+        except BudgetExceededError:
+            raise
+        except (ConnectionError, Timeout):
             raise ConnectionError
         except ConnectionResetError:
-            return
+            return None
 
         try:
             if r:
-                self._json_forecasts = json.loads(r.content.decode())
-                print(self._json_forecasts)
-        except ValueError or TypeError:
+                forecasts = parse_forecasts(json.loads(r.content.decode()), self._days)
+                if forecasts is not None:
+                    self._cache.put(key, [forecast.to_row() for forecast in forecasts])
+                return forecasts
+        except (ValueError, TypeError):
             pass
+        return None
 
-    def update_forecasts(self):
-        try:
-            test = self._json_forecasts['forecast']['simpleforecast']['forecastday']
-        except KeyError or TypeError:
-            print("Empty Forecast Set or Malformed Data")
-            return
+    def apply_forecast_data(self, forecasts):
+        if forecasts is not None:
+            self.publish(tuple(forecasts))
 
-        for i, forecast in enumerate(self.forecasts):
-            forecast.update_day(
-                day=self._json_forecasts['forecast']['simpleforecast']['forecastday'][i]['date']['weekday'],
-                low_temp=self._json_forecasts['forecast']['simpleforecast']['forecastday'][i]['low']['fahrenheit'],
-                high_temp=self._json_forecasts['forecast']['simpleforecast']['forecastday'][i]['high']['fahrenheit'],
-                rain=str(self._json_forecasts['forecast']['simpleforecast']['forecastday'][i]['pop']),
-                icon=self._json_forecasts['forecast']['simpleforecast']['forecastday'][i]['icon'])
+    def update_forecast_data(self):
+        self.apply_forecast_data(self.fetch_forecast_data())
 
 
 if __name__ == '__main__':
     s = Sensor(address=('192.168.0.107', 7001))
     ws = WeatherStationSensor(sensor=s)
-    while True:
-        ws.update_station(verbose=True)
-        time.sleep(1)
+    try:
+        while True:
+            ws.update_station(verbose=True)
+            time.sleep(1)
+    finally:
+        s.close()